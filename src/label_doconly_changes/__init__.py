@@ -0,0 +1,3 @@
+from .app import AnalysisResult, FileResult, analyze
+
+__all__ = ("AnalysisResult", "FileResult", "analyze")
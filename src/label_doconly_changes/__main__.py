@@ -1,7 +1,37 @@
+import argparse
+import importlib
+import sys
+
 from .app import App
 
+#: Subcommands with the names of the modules implementing them and their help.
+#: The modules are only imported when their subcommand is run to keep
+#: the startup of the default command fast.
+COMMANDS = {
+    "serve": ("server", "Run a server handling pull_request webhooks."),
+    "replay": ("bundle", "Replay a recorded bundle with profiling enabled."),
+    "merge": (
+        "sharding",
+        "Merge the results of a sharded run and update the labels.",
+    ),
+}
+
 
 def main() -> None:
+    parser = argparse.ArgumentParser(prog="label-doconly-changes")
+    subparsers = parser.add_subparsers(dest="command")
+    argv = sys.argv[1:]
+    module = None
+    for command, (module_name, help_text) in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=help_text)
+        if argv[:1] == [command]:
+            module = importlib.import_module(f".{module_name}", __package__)
+            module.add_arguments(subparser)
+    args = parser.parse_args(argv)
+
+    if module is not None:
+        raise SystemExit(module.main(args))
+
     app = App.from_environ()
     raise SystemExit(app.run())
 
@@ -1,18 +1,53 @@
 from __future__ import annotations
 
+import copy
 import dataclasses
+import hashlib
 import importlib
+import importlib.metadata
 import json
 import os
 import subprocess
 import sys
-from typing import Literal
+import time
+from collections.abc import Callable, Mapping
+from typing import Any, Literal
 
 import requests
 
-from .base_hooks import FileInfo, Hook, HookModule, get_hook_by_name
+from .base_hooks import (
+    BlobMetadata,
+    FileInfo,
+    Hook,
+    HookModule,
+    MessageDict,
+    MessageType,
+    get_blob_metadata,
+    get_hook_by_name,
+    read_blobs,
+)
+from .cache import DEFAULT_MAX_SIZE, BlobCache
 
-BASE_URL = "https://api.github.com/repos/{repo_full_name}/issues/{pr_number}/labels"
+DEFAULT_API_URL = "https://api.github.com"
+BASE_URL = "{api_url}/repos/{repo_full_name}/issues/{pr_number}/labels"
+REQUEST_TIMEOUT = 30
+TIME_BUDGET_EXHAUSTED_MESSAGE = "timed out (time budget exhausted)."
+#: Actions of the `pull_request` events that can't change the result of the analysis.
+LABEL_ACTIONS = frozenset(("labeled", "unlabeled"))
+#: Namespace and version of the on-disk cache of the results, keyed by fingerprint.
+RESULT_CACHE_NAMESPACE = "results"
+RESULT_CACHE_VERSION = "1"
+#: Options that don't affect the verdict and are not included in the fingerprint.
+FINGERPRINT_EXCLUDED_OPTIONS = frozenset(
+    (
+        "cache_dir",
+        "cache_max_size",
+        "detect_only",
+        "record_bundle",
+        "result_file",
+        "shard",
+    )
+)
 
 
 @dataclasses.dataclass
@@ -21,6 +56,166 @@ class PullRequestInfo:
     number: int
     labels: set[str]
     token: str
+    api_url: str = DEFAULT_API_URL
+    #: Action of the `pull_request` event (e.g. `opened` or `labeled`), if known.
+    action: str | None = None
+
+    @classmethod
+    def from_event(
+        cls, event_data: dict[str, Any], *, token: str, api_url: str = DEFAULT_API_URL
+    ) -> PullRequestInfo:
+        return cls(
+            repo_full_name=event_data["repository"]["full_name"],
+            number=event_data["number"],
+            labels={
+                label_data["name"]
+                for label_data in event_data["pull_request"]["labels"]
+            },
+            token=token,
+            api_url=api_url,
+            action=event_data.get("action"),
+        )
+
+
+@dataclasses.dataclass
+class FileResult:
+    filename: str
+    #: Name of the hook that processed the file or None, if no hook matched it.
+    hook_name: str | None = None
+    is_doc_only: bool = True
+    messages: list[MessageDict] = dataclasses.field(default_factory=list)
+    #: Time (in seconds) spent on the file. This includes reading the file's blobs
+    #: and the file's share of the run time of the hook that processed it.
+    duration: float = 0.0
+    #: Statistics reported by the hook that processed the file, if any.
+    stats: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class RuleSetResult:
+    is_doc_only: bool
+    labels: set[str]
+    files: dict[str, FileResult]
+
+
+@dataclasses.dataclass
+class AnalysisResult:
+    is_doc_only: bool
+    errored: bool
+    #: Results of the files for the first rule set.
+    files: dict[str, FileResult]
+    rulesets: dict[str, RuleSetResult]
+    #: Messages that are not tied to a specific file.
+    messages: list[MessageDict]
+    #: Run time (in seconds) of each of the hooks that were run.
+    hook_durations: dict[str, float]
+    duration: float
+    #: Hash of the base and head trees, the options, and the version of the tool.
+    #: Runs with the same fingerprint analyze the same changes the same way.
+    fingerprint: str | None = None
+    #: Shard (in the `<INDEX>/<COUNT>` format) that the result is for, if sharded.
+    shard: str | None = None
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> AnalysisResult:
+        def get_files(files_data: dict[str, Any]) -> dict[str, FileResult]:
+            return {
+                filename: FileResult(**file_data)
+                for filename, file_data in files_data.items()
+            }
+
+        return cls(
+            is_doc_only=data["is_doc_only"],
+            errored=data["errored"],
+            files=get_files(data["files"]),
+            rulesets={
+                name: RuleSetResult(
+                    is_doc_only=ruleset_data["is_doc_only"],
+                    labels=set(ruleset_data["labels"]),
+                    files=get_files(ruleset_data["files"]),
+                )
+                for name, ruleset_data in data["rulesets"].items()
+            },
+            messages=data["messages"],
+            hook_durations=data["hook_durations"],
+            duration=data["duration"],
+            fingerprint=data["fingerprint"],
+            shard=data["shard"],
+        )
+
+    def get_hook_counts(self) -> dict[str, dict[str, int]]:
+        """Get the number of files (and doc-only files) processed by each hook."""
+        counts: dict[str, dict[str, int]] = {}
+        for file_result in self.files.values():
+            if file_result.hook_name is None:
+                continue
+            hook_counts = counts.setdefault(
+                file_result.hook_name, {"files": 0, "doc_only": 0}
+            )
+            hook_counts["files"] += 1
+            hook_counts["doc_only"] += file_result.is_doc_only
+        return counts
+
+    def to_json(self) -> dict[str, Any]:
+        data = dataclasses.asdict(self)
+        for ruleset_data in data["rulesets"].values():
+            ruleset_data["labels"] = sorted(ruleset_data["labels"])
+        data["hook_counts"] = self.get_hook_counts()
+        return data
+
+
+@dataclasses.dataclass
+class RuleSet:
+    """Named set of hooks and the labels applied when all files pass them."""
+
+    name: str
+    enabled_hooks: list[str]
+    labels: set[str]
+    #: Hook options of the rule set, only the file patterns are used.
+    hook_options: dict[str, dict[str, str]]
+    hooks: list[Hook] = dataclasses.field(default_factory=list)
+    is_doc_only: bool = True
+    file_results: dict[str, FileResult] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_options(
+        cls,
+        name: str,
+        options: dict[str, str],
+        hook_options: dict[str, dict[str, str]],
+    ) -> RuleSet:
+        return cls(
+            name=name,
+            enabled_hooks=[
+                hook_name.strip() for hook_name in options["enabled_hooks"].split(",")
+            ],
+            labels=set(options["labels"].split(",")),
+            hook_options=hook_options,
+        )
+
+    def get_file_patterns(self, hook_name: str) -> list[str] | None:
+        options = self.hook_options.get(hook_name, {})
+        file_patterns = options.get("files", options.get("allowed_files"))
+        if not file_patterns:
+            return None
+        return file_patterns.splitlines()
+
+
+def parse_options(
+    environ: Mapping[str, str]
+) -> tuple[dict[str, str], dict[str, dict[str, str]]]:
+    """Get the app and hook options from the `LDC_*` environment variables."""
+    app_options: dict[str, str] = {}
+    hook_options: dict[str, dict[str, str]] = {}
+    for key, value in environ.items():
+        if key.startswith("LDC_"):
+            if key.startswith("HOOK_", 4):
+                hook_name, _, option_name = key[9:].lower().partition("__")
+                options = hook_options.setdefault(hook_name, {})
+                options[option_name] = value
+            else:
+                app_options[key[4:].lower()] = value
+    return app_options, hook_options
 
 
 class App:
@@ -28,20 +223,35 @@ class App:
         self,
         *,
         base_ref: str,
+        head_ref: str = "HEAD",
+        repo_path: str | None = None,
         options: dict[str, str] | None = None,
         hook_options: dict[str, dict[str, str]] | None = None,
         pr_info: PullRequestInfo | None = None,
+        print_messages: bool = True,
+        file_info_source: Callable[[str], FileInfo] | None = None,
+        file_metadata_source: Callable[
+            [str], tuple[BlobMetadata | None, BlobMetadata | None]
+        ]
+        | None = None,
+        github_output: str | None = None,
     ) -> None:
         self.errored = False
         self.is_doc_only = True
         self.base_ref = base_ref
+        self.head_ref = head_ref
+        #: Path to the git repository, current working directory is used if None.
+        self.repo_path = repo_path
         self.options: dict[str, str] = {
             "enabled_hooks": "unconditional,python",
             "labels": "doc-only",
             **(options or {}),
         }
         self.hook_options = hook_options or {}
+        #: Hooks enabled in any of the rule sets, each hook is only included once.
         self.hooks: list[Hook] = []
+        self.rulesets = self.get_rulesets()
+        self._current_ruleset = self.rulesets[0]
         self.message_callbacks = {
             "fail": self.fail,
             "success": self.success,
@@ -49,12 +259,30 @@ class App:
             "info": self.info,
         }
         self.pr_info = pr_info
+        self.print_messages = print_messages
+        #: Function returning the file info for the given filename,
+        #: the files are read from the git repository if None.
+        self.file_info_source = file_info_source
+        #: Function returning the blob metadata (before and after) for the given
+        #: filename, the metadata is taken from the file infos if None.
+        self.file_metadata_source = file_metadata_source
+        #: Path to the file that the step outputs are written to (`$GITHUB_OUTPUT`).
+        self.github_output = github_output
+        #: Messages that are not tied to a specific file.
+        self.messages: list[MessageDict] = []
+        self.hook_durations: dict[str, float] = {}
+        self.blob_caches: dict[str, BlobCache] = {}
+        self.memos: dict[str, dict[str, Any]] = {}
+        #: Monotonic clock deadlines of the run and the currently running hook.
+        self.deadline: float | None = None
+        self.hook_deadline: float | None = None
 
     @property
     def exit_code(self) -> Literal[0, 1, 2]:
         if self.errored:
             return 1
-        if self.pr_info is not None:
+        # the verdict of a shard is only reported by the merge
+        if self.pr_info is not None or self.options.get("shard"):
             return 0
         if not self.is_doc_only:
             return 2
@@ -62,29 +290,16 @@ class App:
 
     @classmethod
     def from_environ(cls) -> App:
-        app_options: dict[str, str] = {}
-        hook_options: dict[str, dict[str, str]] = {}
-        for key, value in os.environ.items():
-            if key.startswith("LDC_"):
-                if key.startswith("HOOK_", 4):
-                    hook_name, _, option_name = key[9:].lower().partition("__")
-                    options = hook_options.setdefault(hook_name, {})
-                    options[option_name] = value
-                else:
-                    app_options[key[4:].lower()] = value
+        app_options, hook_options = parse_options(os.environ)
 
         pr_info: PullRequestInfo | None = None
         if not bool(int(app_options.get("detect_only", 0))):
             with open(os.environ["GITHUB_EVENT_PATH"], encoding="utf-8") as fp:
                 event_data = json.load(fp)
-                pr_info = PullRequestInfo(
-                    repo_full_name=event_data["repository"]["full_name"],
-                    number=event_data["number"],
-                    labels={
-                        label_data["name"]
-                        for label_data in event_data["pull_request"]["labels"]
-                    },
+                pr_info = PullRequestInfo.from_event(
+                    event_data,
                     token=os.environ["GITHUB_TOKEN"],
+                    api_url=os.environ.get("GITHUB_API_URL", DEFAULT_API_URL),
                 )
 
         return cls(
@@ -92,98 +307,735 @@ class App:
             options=app_options,
             hook_options=hook_options,
             pr_info=pr_info,
+            github_output=os.environ.get("GITHUB_OUTPUT"),
         )
 
+    @property
+    def file_results(self) -> dict[str, FileResult]:
+        return self.rulesets[0].file_results
+
+    def get_rulesets(self) -> list[RuleSet]:
+        """
+        Get the rule sets from the options.
+
+        If `rulesets` option is not set, a single rule set named "default" is created
+        from the global options.
+        """
+        ruleset_names = self.options.get("rulesets")
+        if not ruleset_names:
+            return [RuleSet.from_options("default", self.options, self.hook_options)]
+
+        rulesets = []
+        for name in ruleset_names.split(","):
+            name = name.strip()
+            prefix = f"ruleset_{name.lower().replace('-', '_')}__"
+            options = {"enabled_hooks": self.options["enabled_hooks"], "labels": name}
+            hook_options = {
+                hook_name: dict(global_options)
+                for hook_name, global_options in self.hook_options.items()
+            }
+            for key, value in self.options.items():
+                if not key.startswith(prefix):
+                    continue
+                key = key[len(prefix) :]
+                if key.startswith("hook_"):
+                    hook_name, _, option_name = key[5:].partition("__")
+                    hook_options.setdefault(hook_name, {})[option_name] = value
+                else:
+                    options[key] = value
+            rulesets.append(RuleSet.from_options(name, options, hook_options))
+        return rulesets
+
     def load_hooks(self) -> None:
-        for hook_name in self.options["enabled_hooks"].split(","):
-            hook_name = hook_name.strip()
-            mod_name, _, subhook_name = hook_name.partition(".")
-            module = importlib.import_module(f"label_doconly_changes.hooks.{mod_name}")
-            assert isinstance(module, HookModule)
-            hook = get_hook_by_name(module, hook_name)
-            allowed_files = self.hook_options.get(hook_name, {}).get("allowed_files")
-            if allowed_files:
-                hook.set_file_patterns(allowed_files.splitlines())
-            self.hooks.append(hook)
+        hooks: dict[str, Hook] = {}
+        for ruleset in self.rulesets:
+            for hook_name in ruleset.enabled_hooks:
+                mod_name, _, subhook_name = hook_name.partition(".")
+                module = importlib.import_module(
+                    f"label_doconly_changes.hooks.{mod_name}"
+                )
+                assert isinstance(module, HookModule)
+                hook = get_hook_by_name(module, hook_name)
+                hooks.setdefault(hook.name, hook)
+                file_patterns = ruleset.get_file_patterns(hook_name)
+                if file_patterns:
+                    # hook instances are shared by all apps, don't modify them in place
+                    hook = copy.copy(hook)
+                    hook.set_file_patterns(file_patterns)
+                ruleset.hooks.append(hook)
+        self.hooks = list(hooks.values())
+
+    def get_memo(self, namespace: str) -> dict[str, Any]:
+        """
+        Get the per-run memo for the given namespace.
+
+        The memo can be used by hooks to share data (e.g. parsed files)
+        between hooks and between files with the same blobs during a single run.
+        """
+        return self.memos.setdefault(namespace, {})
+
+    def get_blob_cache(self, namespace: str, version: str) -> BlobCache | None:
+        """
+        Get the on-disk cache for the given namespace.
+
+        Returns None, if caching is not enabled.
+        """
+        cache_dir = self.options.get("cache_dir")
+        if not cache_dir:
+            return None
+        try:
+            return self.blob_caches[namespace]
+        except KeyError:
+            pass
+        cache = self.blob_caches[namespace] = BlobCache(
+            os.path.expanduser(cache_dir),
+            namespace=namespace,
+            version=version,
+            max_size=int(self.options.get("cache_max_size", DEFAULT_MAX_SIZE)),
+        )
+        return cache
+
+    def get_result_cache(self) -> BlobCache | None:
+        """
+        Get the on-disk cache of the results, keyed by their fingerprint.
+
+        Returns None, if caching is not enabled.
+        """
+        return self.get_blob_cache(RESULT_CACHE_NAMESPACE, RESULT_CACHE_VERSION)
+
+    def get_file_info(self, filename: str) -> FileInfo:
+        if self.file_info_source is not None:
+            return self.file_info_source(filename)
+        return FileInfo.from_filename(
+            filename,
+            base_ref=self.base_ref,
+            head_ref=self.head_ref,
+            repo_path=self.repo_path,
+        )
+
+    def get_file_metadata(
+        self, files: list[str]
+    ) -> dict[str, tuple[BlobMetadata | None, BlobMetadata | None]]:
+        """
+        Get the metadata of the before and after blobs of the passed files
+        without reading the blobs (unless the files come from `file_info_source`).
+        """
+        if self.file_metadata_source is not None:
+            return {filename: self.file_metadata_source(filename) for filename in files}
+        if self.file_info_source is not None:
+            metadata = {}
+            for filename in files:
+                try:
+                    file_info = self.file_info_source(filename)
+                except FileNotFoundError:
+                    metadata[filename] = (None, None)
+                    continue
+                metadata[filename] = (
+                    BlobMetadata.from_blob(file_info.blob_before, file_info.sha_before),
+                    BlobMetadata.from_blob(file_info.blob_after, file_info.sha_after),
+                )
+            return metadata
+
+        blobs = get_blob_metadata(
+            [
+                f"{ref}:{filename}"
+                for filename in files
+                for ref in (self.base_ref, self.head_ref)
+            ],
+            repo_path=self.repo_path,
+        )
+        return {
+            filename: (blobs[idx * 2], blobs[idx * 2 + 1])
+            for idx, filename in enumerate(files)
+        }
+
+    def load_files(
+        self,
+        files: list[str],
+        metadata: dict[str, tuple[BlobMetadata | None, BlobMetadata | None]],
+    ) -> tuple[dict[str, FileInfo], dict[str, str]]:
+        """
+        Load the file infos of the passed files, using their (already known) metadata.
+
+        Returns the file infos and the errors of the files that couldn't be loaded.
+        """
+        file_infos: dict[str, FileInfo] = {}
+        load_errors: dict[str, str] = {}
+        if self.file_info_source is not None:
+            for filename in files:
+                try:
+                    file_infos[filename] = self.get_file_info(filename)
+                except FileNotFoundError as exc:
+                    load_errors[filename] = str(exc)
+            return file_infos, load_errors
+
+        # all blobs are read with a single query, identical blobs are only read once
+        blobs = read_blobs(
+            (
+                blob.sha
+                for filename in files
+                for blob in metadata[filename]
+                if blob is not None
+            ),
+            repo_path=self.repo_path,
+        )
+        for filename in files:
+            before, after = metadata[filename]
+            file_infos[filename] = FileInfo(
+                filename,
+                None if before is None else blobs[before.sha],
+                None if after is None else blobs[after.sha],
+                sha_before=None if before is None else before.sha,
+                sha_after=None if after is None else after.sha,
+            )
+        return file_infos, load_errors
+
+    def get_file_result(self, filename: str) -> FileResult:
+        file_results = self._current_ruleset.file_results
+        try:
+            return file_results[filename]
+        except KeyError:
+            result = file_results[filename] = FileResult(filename)
+            return result
+
+    def _record_message(
+        self, msg_type: MessageType, filename: str | None, text: str
+    ) -> None:
+        message: MessageDict = {
+            "type": msg_type,
+            "filename": filename or "",
+            "text": text,
+        }
+        if not filename:
+            self.messages.append(message)
+            return
+        result = self.get_file_result(filename)
+        result.messages.append(message)
+        if msg_type in ("fail", "error"):
+            result.is_doc_only = False
 
     def fail(self, filename: str, text: str) -> None:
         self.is_doc_only = False
-        print("!!!", filename, text, file=sys.stderr)
+        self._current_ruleset.is_doc_only = False
+        self._record_message("fail", filename, text)
+        if self.print_messages:
+            print("!!!", filename, text, file=sys.stderr)
 
     def success(self, filename: str, text: str) -> None:
-        print(filename, text)
+        self._record_message("success", filename, text)
+        if self.print_messages:
+            print(filename, text)
 
     def error(self, filename: str | None, text: str) -> None:
         self.errored = True
         self.is_doc_only = False
+        self._current_ruleset.is_doc_only = False
+        self._record_message("error", filename, text)
+        if not self.print_messages:
+            return
         if filename:
             print("!!!", filename, text, file=sys.stderr)
         else:
             print("!!!", text, file=sys.stderr)
 
     def info(self, filename: str, text: str) -> None:
-        print(filename, text)
+        self._record_message("info", filename, text)
+        if self.print_messages:
+            print(filename, text)
+
+    def get_time_left(self) -> float | None:
+        """
+        Get the time left for the currently running hook.
+
+        This takes both the run's time budget and the hook's timeout into account.
+        Returns None, if there's no time limit.
+        """
+        deadlines = [
+            deadline
+            for deadline in (self.deadline, self.hook_deadline)
+            if deadline is not None
+        ]
+        if not deadlines:
+            return None
+        return min(deadlines) - time.monotonic()
+
+    def get_file_timeout(self, hook: Hook) -> float | None:
+        """
+        Get the time limit for processing a single file with the given hook.
+
+        Returns None, if there's no time limit.
+        """
+        file_timeout = self.hook_options.get(hook.name, {}).get(
+            "file_timeout", self.options.get("file_timeout")
+        )
+        timeout = float(file_timeout) if file_timeout else None
+        time_left = self.get_time_left()
+        if time_left is not None and (timeout is None or time_left < timeout):
+            timeout = max(time_left, 0.0)
+        return timeout
 
     def _process_files(self, files: list[str]) -> None:
+        time_budget = self.options.get("time_budget")
+        if time_budget and self.deadline is None:
+            self.deadline = time.monotonic() + float(time_budget)
         self.load_hooks()
-        to_run: dict[Hook, list[FileInfo]] = {hook: [] for hook in self.hooks}
 
-        for filename in files:
-            for hook in self.hooks:
-                if hook.spec.match_file(filename):
-                    try:
-                        info = FileInfo.from_filename(filename, base_ref=self.base_ref)
-                    except FileNotFoundError as exc:
-                        self.fail(filename, str(exc))
-                    else:
-                        to_run[hook].append(info)
-                    break
-            else:
-                self.fail(filename, "is not documentation.")
+        # find the hook handling each file in each of the rule sets, each hook is
+        # then run only once on all files that it handles in any of the rule sets
+        assignments: dict[str, dict[str, str | None]] = {}
+        to_run: dict[str, dict[str, None]] = {hook.name: {} for hook in self.hooks}
+        for ruleset in self.rulesets:
+            assignment = assignments[ruleset.name] = {}
+            for filename in files:
+                assignment[filename] = None
+                for hook in ruleset.hooks:
+                    if hook.spec.match_file(filename):
+                        assignment[filename] = hook.name
+                        to_run[hook.name][filename] = None
+                        break
+
+        # the size policies are applied before any of the blobs are read
+        files_to_load = [
+            filename
+            for filename in files
+            if any(filename in filenames for filenames in to_run.values())
+        ]
+        metadata = self.get_file_metadata(files_to_load)
+        sizes = {
+            filename: max((blob.size for blob in blobs if blob is not None), default=0)
+            for filename, blobs in metadata.items()
+        }
+        too_large: dict[str, dict[str, int]] = {}
+        for hook in self.hooks:
+            max_size = self.hook_options.get(hook.name, {}).get("max_size")
+            if not max_size:
+                continue
+            for filename in list(to_run[hook.name]):
+                if sizes[filename] > int(max_size):
+                    too_large.setdefault(hook.name, {})[filename] = int(max_size)
+                    del to_run[hook.name][filename]
+        files_to_load = [
+            filename
+            for filename in files_to_load
+            if any(filename in filenames for filenames in to_run.values())
+        ]
 
-        for hook, file_data in to_run.items():
-            output = hook.run(self, file_data)
+        start = time.perf_counter()
+        file_infos, load_errors = self.load_files(files_to_load, metadata)
+        load_duration = time.perf_counter() - start
+        # the time spent on reading the blobs is attributed by their size
+        total_size = sum(sizes[filename] for filename in files_to_load) or 1
+        durations = {
+            filename: load_duration * sizes[filename] / total_size
+            for filename in files_to_load
+        }
+
+        record_bundle = self.options.get("record_bundle")
+        if record_bundle:
+            from .bundle import Bundle
+
+            Bundle.from_app(
+                self,
+                files,
+                list(file_infos.values()),
+                skipped_files={
+                    filename: blobs
+                    for filename, blobs in metadata.items()
+                    if filename not in file_infos
+                },
+            ).write(record_bundle)
+
+        hook_messages: dict[str, list[MessageDict]] = {}
+        hook_durations: dict[tuple[str, str], float] = {}
+        hook_stats: dict[tuple[str, str], dict[str, Any]] = {}
+        for hook in self.hooks:
+            messages = hook_messages[hook.name] = []
+            for filename, max_size in too_large.get(hook.name, {}).items():
+                messages.append(
+                    {
+                        "type": "fail",
+                        "filename": filename,
+                        "text": (
+                            f"is too large ({sizes[filename]} bytes,"
+                            f" the limit is {max_size} bytes)."
+                        ),
+                    }
+                )
+            file_data = [
+                file_infos[filename]
+                for filename in to_run[hook.name]
+                if filename in file_infos
+            ]
+            # files with identical (before, after) blob pairs only need to be
+            # analyzed once, the result is then reported for each of them
+            aliases: dict[str, list[str]] = {}
+            if hook.DEDUPLICATE_FILES:
+                unique_files: dict[tuple[str | None, str | None], FileInfo] = {}
+                files_to_run = []
+                for file_info in file_data:
+                    key = (file_info.sha_before, file_info.sha_after)
+                    if key != (None, None):
+                        first = unique_files.setdefault(key, file_info)
+                        if first is not file_info:
+                            aliases.setdefault(first.filename, []).append(
+                                file_info.filename
+                            )
+                            continue
+                    files_to_run.append(file_info)
+                file_data = files_to_run
+
+            time_left = self.get_time_left()
+            if time_left is not None and time_left <= 0:
+                for file_info in file_data:
+                    for filename in (
+                        file_info.filename,
+                        *aliases.get(file_info.filename, ()),
+                    ):
+                        messages.append(
+                            {
+                                "type": "fail",
+                                "filename": filename,
+                                "text": TIME_BUDGET_EXHAUSTED_MESSAGE,
+                            }
+                        )
+                continue
+
+            hook_timeout = self.hook_options.get(hook.name, {}).get("timeout")
+            if hook_timeout:
+                self.hook_deadline = time.monotonic() + float(hook_timeout)
+            start = time.perf_counter()
+            try:
+                output = hook.run(self, file_data)
+            finally:
+                self.hook_deadline = None
+            hook_duration = time.perf_counter() - start
+            self.hook_durations[hook.name] = hook_duration
+            for file_info in file_data:
+                hook_durations[hook.name, file_info.filename] = hook_duration / len(
+                    file_data
+                )
             for message in output["messages"]:
+                for filename in (
+                    message["filename"],
+                    *aliases.get(message["filename"], ()),
+                ):
+                    messages.append({**message, "filename": filename})
+            for filename, stats in output.get("stats", {}).items():
+                for alias in (filename, *aliases.get(filename, ())):
+                    hook_stats[hook.name, alias] = stats
+
+        for ruleset in self.rulesets:
+            self._report_ruleset(
+                ruleset,
+                assignments[ruleset.name],
+                hook_messages,
+                load_errors=load_errors,
+                durations={
+                    filename: durations.get(filename, 0.0)
+                    + hook_durations.get((hook_name, filename), 0.0)
+                    for filename, hook_name in assignments[ruleset.name].items()
+                    if hook_name is not None
+                },
+                stats={
+                    filename: hook_stats[hook_name, filename]
+                    for filename, hook_name in assignments[ruleset.name].items()
+                    if (hook_name, filename) in hook_stats
+                },
+            )
+        self._current_ruleset = self.rulesets[0]
+
+    def _report_ruleset(
+        self,
+        ruleset: RuleSet,
+        assignment: dict[str, str | None],
+        hook_messages: dict[str, list[MessageDict]],
+        *,
+        load_errors: dict[str, str],
+        durations: dict[str, float],
+        stats: dict[str, dict[str, Any]],
+    ) -> None:
+        self._current_ruleset = ruleset
+        if len(self.rulesets) > 1 and self.print_messages:
+            print(f"--- Rule set {ruleset.name!r} ---")
+
+        for filename, hook_name in assignment.items():
+            if hook_name is None:
+                self.fail(filename, "is not documentation.")
+                continue
+            result = self.get_file_result(filename)
+            result.hook_name = hook_name
+            result.duration = durations[filename]
+            result.stats = stats.get(filename, {})
+            if filename in load_errors:
+                self.fail(filename, load_errors[filename])
+
+        hook_names = {hook.name for hook in ruleset.hooks}
+        for hook in self.hooks:
+            if hook.name not in hook_names:
+                continue
+            for message in hook_messages[hook.name]:
                 filename = message["filename"]
-                text = message["text"]
-                msg_type = message["type"]
-                self.message_callbacks[msg_type](filename, text)
+                if not filename or assignment.get(filename) == hook.name:
+                    self.message_callbacks[message["type"]](filename, message["text"])
 
     def _update_labels(self) -> None:
         session = requests.Session()
         session.headers["Authorization"] = f"Bearer {self.pr_info.token}"
-        labels = set(self.options["labels"].split(","))
+        managed_labels: set[str] = set()
+        labels: set[str] = set()
+        for ruleset in self.rulesets:
+            managed_labels |= ruleset.labels
+            if ruleset.is_doc_only:
+                labels |= ruleset.labels
+        labels_to_apply = labels - self.pr_info.labels
+        labels_to_remove = (managed_labels - labels) & self.pr_info.labels
         try:
             base_url = BASE_URL.format(
+                api_url=self.pr_info.api_url,
                 repo_full_name=self.pr_info.repo_full_name,
                 pr_number=self.pr_info.number,
             )
-            if self.is_doc_only:
-                labels_to_apply = labels - self.pr_info.labels
-                if labels_to_apply:
-                    resp = session.post(
-                        base_url, json={"labels": list(labels_to_apply)}
-                    )
-                    resp.raise_for_status()
-            else:
-                labels_to_remove = labels & self.pr_info.labels
-                for label in labels_to_remove:
-                    resp = session.delete(f"{base_url}/{label}")
+            # The PR's labels from the event can be outdated (e.g. the labels added
+            # while the event was queued) so the label set is never replaced.
+            # Additions are applied with a single request and only the managed
+            # labels are removed.
+            if labels_to_apply:
+                resp = session.post(
+                    base_url,
+                    json={"labels": sorted(labels_to_apply)},
+                    timeout=REQUEST_TIMEOUT,
+                )
+                resp.raise_for_status()
+            for label in sorted(labels_to_remove):
+                resp = session.delete(f"{base_url}/{label}", timeout=REQUEST_TIMEOUT)
+                # the label might have already been removed since the event was sent
+                if resp.status_code != 404:
                     resp.raise_for_status()
-        except requests.HTTPError as exc:
+        except requests.RequestException as exc:
             self.error(None, str(exc))
 
-    def run(self) -> int:
+    def report_result(self, result: AnalysisResult) -> None:
+        """
+        Report the passed result (e.g. merged from the results of the shards)
+        as if the files were processed by this app.
+        """
+        for ruleset in self.rulesets:
+            self._current_ruleset = ruleset
+            if len(self.rulesets) > 1 and self.print_messages:
+                print(f"--- Rule set {ruleset.name!r} ---")
+            ruleset_result = result.rulesets[ruleset.name]
+            for filename, file_result in ruleset_result.files.items():
+                own_result = self.get_file_result(filename)
+                own_result.hook_name = file_result.hook_name
+                own_result.duration = file_result.duration
+                own_result.stats = file_result.stats
+                for message in file_result.messages:
+                    self.message_callbacks[message["type"]](filename, message["text"])
+            ruleset.is_doc_only = ruleset.is_doc_only and ruleset_result.is_doc_only
+        self._current_ruleset = self.rulesets[0]
+
+        for message in result.messages:
+            self.message_callbacks[message["type"]](
+                message["filename"], message["text"]
+            )
+        self.is_doc_only = self.is_doc_only and result.is_doc_only
+        self.errored = self.errored or result.errored
+        self.hook_durations.update(result.hook_durations)
+
+    def get_fingerprint(self) -> str:
+        """
+        Get the fingerprint of the run's inputs.
+
+        This is a hash of the base and head trees (and not commits so that e.g.
+        a rebase without conflicts keeps it the same), the options that can affect
+        the verdict, and the version of the tool.
+        """
+        base_tree, head_tree = subprocess.check_output(
+            (
+                "git",
+                "rev-parse",
+                f"{self.base_ref}^{{tree}}",
+                f"{self.head_ref}^{{tree}}",
+            ),
+            cwd=self.repo_path,
+            encoding="utf-8",
+        ).split()
+        data = {
+            "version": importlib.metadata.version("label-doconly-changes"),
+            "base_tree": base_tree,
+            "head_tree": head_tree,
+            "options": {
+                key: value
+                for key, value in self.options.items()
+                if key not in FINGERPRINT_EXCLUDED_OPTIONS
+            },
+            "hook_options": self.hook_options,
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+
+    def get_result(
+        self, duration: float, *, fingerprint: str | None = None
+    ) -> AnalysisResult:
+        return AnalysisResult(
+            is_doc_only=self.is_doc_only,
+            errored=self.errored,
+            files=self.file_results,
+            rulesets={
+                ruleset.name: RuleSetResult(
+                    is_doc_only=ruleset.is_doc_only,
+                    labels=ruleset.labels,
+                    files=ruleset.file_results,
+                )
+                for ruleset in self.rulesets
+            },
+            messages=self.messages,
+            hook_durations=self.hook_durations,
+            duration=duration,
+            fingerprint=fingerprint,
+            shard=self.options.get("shard") or None,
+        )
+
+    def analyze(self, *, fingerprint: str | None = None) -> AnalysisResult:
+        """
+        Analyze the changes between the base and head refs.
+
+        The run's fingerprint is calculated, unless it's passed.
+        """
+        start = time.perf_counter()
         files = subprocess.check_output(
-            ("git", "diff", "--name-only", f"{self.base_ref}.."), encoding="utf-8"
+            ("git", "diff", "--name-only", f"{self.base_ref}..{self.head_ref}"),
+            cwd=self.repo_path,
+            encoding="utf-8",
         ).splitlines()
 
-        if not files:
+        shard = self.options.get("shard")
+        if files and shard:
+            from .sharding import get_shard_files
+
+            files_to_process = get_shard_files(self, files, shard)
+        else:
+            files_to_process = files
+
+        if files_to_process:
+            self._process_files(files_to_process)
+            # the stored results are evicted together with the other caches
+            self.get_result_cache()
+            for cache in self.blob_caches.values():
+                cache.evict()
+        elif not files:
             self.error(None, "The base branch and merge branch are identical.")
-            return self.exit_code
 
-        self._process_files(files)
-        if self.pr_info is not None:
+        if fingerprint is None:
+            fingerprint = self.get_fingerprint()
+        return self.get_result(time.perf_counter() - start, fingerprint=fingerprint)
+
+    def write_outputs(self, result: AnalysisResult) -> None:
+        """
+        Write the step outputs (if running in GitHub Actions) and the result file
+        (if `result_file` option is set).
+        """
+        result_file = self.options.get("result_file")
+        if result_file:
+            with open(result_file, "w", encoding="utf-8") as fp:
+                json.dump(result.to_json(), fp, indent=4)
+        if not self.github_output:
+            return
+        outputs = {
+            "is-doc-only": json.dumps(result.is_doc_only),
+            "errored": json.dumps(result.errored),
+            "fingerprint": result.fingerprint or "",
+            "hook-counts": json.dumps(result.get_hook_counts(), sort_keys=True),
+            "rulesets": json.dumps(
+                {
+                    name: ruleset_result.is_doc_only
+                    for name, ruleset_result in result.rulesets.items()
+                }
+            ),
+            "result-file": result_file or "",
+        }
+        with open(self.github_output, "a", encoding="utf-8") as fp:
+            for name, value in outputs.items():
+                fp.write(f"{name}={value}\n")
+
+    def get_stored_result(self, fingerprint: str) -> AnalysisResult | None:
+        """
+        Get the stored result of an earlier run with the same fingerprint,
+        if this run was triggered by a label change.
+
+        Label changes can't change the result so only the labels need to be updated.
+        Returns None, if the analysis needs to be run.
+        """
+        if self.pr_info is None or self.pr_info.action not in LABEL_ACTIONS:
+            return None
+        if self.options.get("shard"):
+            return None
+        cache = self.get_result_cache()
+        if cache is None:
+            return None
+        data = cache.get(fingerprint)
+        if data is None:
+            return None
+        try:
+            return AnalysisResult.from_json(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def store_result(self, result: AnalysisResult) -> None:
+        """Store the result for reuse by the runs triggered by label changes."""
+        if result.errored or result.fingerprint is None or result.shard is not None:
+            return
+        cache = self.get_result_cache()
+        if cache is None:
+            return
+        cache.set(
+            result.fingerprint,
+            json.dumps(result.to_json(), separators=(",", ":")).encode(),
+        )
+
+    def run(self) -> int:
+        fingerprint = self.get_fingerprint()
+        result = self.get_stored_result(fingerprint)
+        if result is None:
+            result = self.analyze(fingerprint=fingerprint)
+            self.store_result(result)
+        else:
+            if self.print_messages:
+                print(
+                    "Reusing the stored result of an earlier run"
+                    f" (fingerprint: {result.fingerprint})."
+                )
+            self.report_result(result)
+        # labels of a sharded run are only updated by the merge
+        if result.files and self.pr_info is not None and not self.options.get("shard"):
             self._update_labels()
+            result.errored = self.errored
+        self.write_outputs(result)
 
         return self.exit_code
+
+
+def analyze(
+    repo_path: str,
+    base_ref: str,
+    head_ref: str = "HEAD",
+    *,
+    options: dict[str, str] | None = None,
+    hook_options: dict[str, dict[str, str]] | None = None,
+) -> AnalysisResult:
+    """
+    Analyze the changes between the passed refs of the repository.
+
+    Nothing is printed and no labels are updated. This is safe to call concurrently
+    from multiple threads.
+    """
+    app = App(
+        base_ref=base_ref,
+        head_ref=head_ref,
+        repo_path=repo_path,
+        options=options,
+        hook_options=hook_options,
+        print_messages=False,
+    )
+    return app.analyze()
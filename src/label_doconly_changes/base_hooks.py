@@ -1,16 +1,27 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import json
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.pool
 import os
+import signal
 import subprocess
 import tempfile
+import threading
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
     Iterable,
     Literal,
+    NamedTuple,
+    NotRequired,
     Protocol,
     TypedDict,
+    TypeVar,
     runtime_checkable,
 )
 
@@ -21,6 +32,7 @@ if TYPE_CHECKING:
 
 
 MessageType = Literal["fail", "success", "error", "info"]
+_T = TypeVar("_T")
 
 
 class FileInfoDict(TypedDict):
@@ -45,16 +57,119 @@ class HookOutputDict(TypedDict):
     errored: bool
     is_doc_only: bool
     messages: list[MessageDict]
+    #: Machine-readable statistics of the processed files, keyed by filename.
+    stats: NotRequired[dict[str, dict[str, Any]]]
 
 
-def _get_file_from_ref(*, ref: str, filename: str) -> str | None:
+def get_blob_sha(data: bytes) -> str:
+    """Calculate the object name that git uses for a blob with the passed data."""
+    h = hashlib.sha1(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+class BlobMetadata(NamedTuple):
+    sha: str
+    size: int
+
+    @classmethod
+    def from_blob(cls, blob: bytes | None, sha: str | None) -> BlobMetadata | None:
+        if blob is None:
+            return None
+        return cls(get_blob_sha(blob) if sha is None else sha, len(blob))
+
+
+def get_blob_metadata(
+    object_names: list[str], *, repo_path: str | None = None
+) -> list[BlobMetadata | None]:
+    """
+    Get the SHAs and sizes of the blobs with the passed object names
+    (e.g. `<REF>:<PATH>`) with a single batched query, without reading the blobs.
+
+    None is returned for the names that don't refer to an existing blob.
+    """
+    if not object_names:
+        return []
+    output = subprocess.run(
+        ("git", "cat-file", "--batch-check=%(objectname) %(objecttype) %(objectsize)"),
+        input="".join(f"{name}\n" for name in object_names),
+        capture_output=True,
+        check=True,
+        cwd=repo_path,
+        encoding="utf-8",
+    ).stdout
+    metadata: list[BlobMetadata | None] = []
+    for line in output.splitlines():
+        # missing objects are reported as `<NAME> missing`
+        parts = line.split(" ")
+        if len(parts) == 3 and parts[1] == "blob" and parts[2].isdigit():
+            metadata.append(BlobMetadata(parts[0], int(parts[2])))
+        else:
+            metadata.append(None)
+    return metadata
+
+
+def read_blobs(
+    shas: Iterable[str], *, repo_path: str | None = None
+) -> dict[str, bytes]:
+    """
+    Read the blobs with the passed SHAs with a single batched query.
+
+    The blobs are read from the pipe one at a time so that the output
+    of the query is never held in memory as a whole.
+    """
+    shas = list(dict.fromkeys(shas))
+    if not shas:
+        return {}
+    args = ("git", "cat-file", "--batch")
+    blobs = {}
+    with subprocess.Popen(
+        args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=repo_path
+    ) as process:
+        assert process.stdin is not None and process.stdout is not None
+        stdin = process.stdin
+
+        # the input is written from another thread as git stops reading it
+        # when the pipe with its (not yet read) output gets full
+        def write_input() -> None:
+            with contextlib.suppress(BrokenPipeError), stdin:
+                stdin.write("".join(f"{sha}\n" for sha in shas).encode())
+
+        writer = threading.Thread(target=write_input, daemon=True)
+        writer.start()
+        try:
+            for sha in shas:
+                # each blob is preceded by a `<SHA> <TYPE> <SIZE>` header line
+                # and followed by a newline
+                header = process.stdout.readline()
+                try:
+                    size = int(header.rsplit(b" ", 1)[1])
+                except (IndexError, ValueError):
+                    raise ValueError(
+                        f"Can't read the blob {sha}: {header.decode().strip()}"
+                    ) from None
+                blobs[sha] = process.stdout.read(size)
+                process.stdout.read(1)
+        except BaseException:
+            # git would otherwise get stuck writing the output that is never read
+            process.kill()
+            raise
+        finally:
+            writer.join()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return blobs
+
+
+def _get_blob_from_ref(
+    *, ref: str, filename: str, repo_path: str | None = None
+) -> bytes | None:
     try:
-        # this can't use `check_output()`'s encoding or text kwarg
-        # instead of `.decode("utf-8")` because that forces universal newline behavior
         return subprocess.check_output(
             ("git", "cat-file", "blob", f"{ref}:{filename}"),
             stderr=subprocess.PIPE,
-        ).decode("utf-8")
+            cwd=repo_path,
+        )
     except subprocess.CalledProcessError as e:
         prefixes = tuple(
             f"fatal: path '{filename}' {error_msg} '".encode()
@@ -70,21 +185,85 @@ def _get_file_from_ref(*, ref: str, filename: str) -> str | None:
 
 
 class FileInfo:
-    __slots__ = ("filename", "contents_before", "contents_after")
+    """
+    Contents of a file before and after the change.
+
+    The contents are stored as raw blobs and decoded (as UTF-8) on first access
+    of `contents_before`/`contents_after`. Hooks that can work with bytes
+    (or that need to respect a different encoding) should use the blobs directly.
+    """
+
+    __slots__ = (
+        "filename",
+        "blob_before",
+        "blob_after",
+        "sha_before",
+        "sha_after",
+        "_contents_before",
+        "_contents_after",
+    )
 
     def __init__(
-        self, filename: str, contents_before: str | None, contents_after: str | None
+        self,
+        filename: str,
+        blob_before: bytes | None,
+        blob_after: bytes | None,
+        *,
+        sha_before: str | None = None,
+        sha_after: str | None = None,
     ) -> None:
         self.filename = filename
-        self.contents_before = contents_before
-        self.contents_after = contents_after
+        self.blob_before = blob_before
+        self.blob_after = blob_after
+        #: Blob SHAs of the contents, if known.
+        self.sha_before = sha_before
+        self.sha_after = sha_after
+        self._contents_before: str | None = None
+        self._contents_after: str | None = None
 
     @classmethod
-    def from_filename(cls, filename: str, *, base_ref: str) -> FileInfo:
-        contents_before = _get_file_from_ref(ref=base_ref, filename=filename)
-        contents_after = _get_file_from_ref(ref="HEAD", filename=filename)
+    def from_filename(
+        cls,
+        filename: str,
+        *,
+        base_ref: str,
+        head_ref: str = "HEAD",
+        repo_path: str | None = None,
+    ) -> FileInfo:
+        blob_before = _get_blob_from_ref(
+            ref=base_ref, filename=filename, repo_path=repo_path
+        )
+        blob_after = _get_blob_from_ref(
+            ref=head_ref, filename=filename, repo_path=repo_path
+        )
+        return cls(
+            filename,
+            blob_before,
+            blob_after,
+            sha_before=None if blob_before is None else get_blob_sha(blob_before),
+            sha_after=None if blob_after is None else get_blob_sha(blob_after),
+        )
 
-        return cls(filename, contents_before, contents_after)
+    # these can't use `check_output()`'s encoding or text kwarg
+    # instead of `.decode("utf-8")` because that forces universal newline behavior
+    @property
+    def contents_before(self) -> str | None:
+        if self._contents_before is None and self.blob_before is not None:
+            self._contents_before = self.blob_before.decode("utf-8")
+        return self._contents_before
+
+    @property
+    def contents_after(self) -> str | None:
+        if self._contents_after is None and self.blob_after is not None:
+            self._contents_after = self.blob_after.decode("utf-8")
+        return self._contents_after
+
+    @property
+    def is_unchanged(self) -> bool:
+        """Whether the file exists on both refs and its blobs are identical."""
+        if self.sha_before is not None and self.sha_after is not None:
+            return self.sha_before == self.sha_after
+        return self.blob_before is not None and self.blob_before == self.blob_after
 
     def to_json(self) -> FileInfoDict:
         return {
@@ -95,12 +274,13 @@ class FileInfo:
 
 
 class HookOutput:
-    __slots__ = ("errored", "is_doc_only", "messages")
+    __slots__ = ("errored", "is_doc_only", "messages", "stats")
 
     def __init__(self) -> None:
         self.errored = False
         self.is_doc_only = True
         self.messages = []
+        self.stats: dict[str, dict[str, Any]] = {}
 
     def _add_message(self, msg_type: MessageType, filename: str, text: str) -> None:
         self.messages.append(
@@ -126,16 +306,22 @@ class HookOutput:
     def info(self, filename: str, text: str) -> None:
         self._add_message("info", filename, text)
 
+    def add_stats(self, filename: str, stats: dict[str, Any]) -> None:
+        self.stats[filename] = stats
+
     def to_json(self) -> HookOutputDict:
         return {
             "errored": self.errored,
             "is_doc_only": self.is_doc_only,
             "messages": self.messages,
+            "stats": self.stats,
         }
 
 
 class Hook:
     HOOKS_DIR = os.path.join(os.path.dirname(__file__), "hooks")
+    #: Whether the files with identical blobs can be passed to the hook only once.
+    DEDUPLICATE_FILES = True
 
     def __init__(
         self,
@@ -172,6 +358,9 @@ class Hook:
 
 
 class SubprocessHook(Hook):
+    # external scripts may depend on the filenames
+    DEDUPLICATE_FILES = False
+
     def __init__(
         self,
         module_name: str,
@@ -199,12 +388,106 @@ class SubprocessHook(Hook):
             with open(os.path.join(tmp_dir, "input.json"), "w", encoding="utf-8") as fp:
                 json.dump(hook_input, fp, separators=(",", ":"))
 
-            subprocess.run((executable_name, self.script_name, tmp_dir), check=True)
+            timeout = app.get_time_left()
+            try:
+                _run_with_timeout(
+                    (executable_name, self.script_name, tmp_dir), timeout=timeout
+                )
+            except subprocess.TimeoutExpired:
+                hook_output = HookOutput()
+                for file_info in file_data:
+                    hook_output.fail(
+                        file_info.filename, f"timed out after {timeout:g} seconds."
+                    )
+                return hook_output.to_json()
 
             with open(os.path.join(tmp_dir, "output.json"), encoding="utf-8") as fp:
                 return json.load(fp)
 
 
+def _run_with_timeout(args: tuple[str, ...], *, timeout: float | None) -> None:
+    """
+    Run the command, killing it and all of its children if it exceeds the timeout.
+
+    Raises `subprocess.TimeoutExpired` when the command gets killed
+    and `subprocess.CalledProcessError` when it exits with non-zero code.
+    """
+    if timeout is not None and timeout <= 0:
+        raise subprocess.TimeoutExpired(args, 0)
+    # start the process in a new session on POSIX so that the whole process group
+    # can be killed, otherwise the children would be left running
+    start_new_session = os.name == "posix"
+    with subprocess.Popen(args, start_new_session=start_new_session) as process:
+        try:
+            retcode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if start_new_session:
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait()
+            raise
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, args)
+
+
+def get_mp_context() -> multiprocessing.context.BaseContext:
+    """Get the multiprocessing context that should be used for worker processes."""
+    # forking a (potentially multi-threaded) process isn't safe
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+class ProcessWatchdog:
+    """
+    Runner of functions that kills them when they exceed the passed timeout.
+
+    Functions without a timeout are called directly, functions with a timeout
+    are called in a worker process that gets killed (and later replaced)
+    when the function doesn't return in time. The functions and their arguments
+    need to be picklable.
+    """
+
+    def __init__(self) -> None:
+        self._pool: multiprocessing.pool.Pool | None = None
+
+    def __enter__(self) -> ProcessWatchdog:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def call(self, func: Callable[..., _T], *args: Any, timeout: float | None) -> _T:
+        """
+        Call the function with the passed arguments.
+
+        Raises `TimeoutError`, if the function doesn't return in time.
+        """
+        if timeout is None:
+            return func(*args)
+        if timeout <= 0:
+            raise TimeoutError
+        if self._pool is None:
+            self._pool = get_mp_context().Pool(1)
+        result = self._pool.apply_async(func, args)
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            raise TimeoutError from None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
 @runtime_checkable
 class HookModule(Protocol):
     __name__: str
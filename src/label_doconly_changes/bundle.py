@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import argparse
+import cProfile
+import dataclasses
+import importlib.metadata
+import json
+import os
+import pstats
+import sys
+import zipfile
+from typing import Any
+
+from .app import App, parse_options
+from .base_hooks import BlobMetadata, FileInfo, get_blob_sha
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+#: Options that are specific to the environment of the recorded run.
+EXCLUDED_OPTIONS = frozenset(("cache_dir", "record_bundle", "result_file", "shard"))
+
+
+@dataclasses.dataclass
+class Bundle:
+    """
+    Self-contained snapshot of the inputs of a run that can be replayed offline.
+
+    The bundle is stored as a zip file with a JSON manifest (the options,
+    the changed files, the blob SHAs of the files that were read by the hooks,
+    and the blob metadata of the files skipped by the size policies)
+    and the blobs stored as `blobs/<SHA>`.
+    """
+
+    base_ref: str
+    head_ref: str
+    options: dict[str, str]
+    hook_options: dict[str, dict[str, str]]
+    #: All files changed between the base and head refs.
+    files: list[str]
+    #: Blob SHAs (before and after) of the files that were read by the hooks.
+    file_blobs: dict[str, tuple[str | None, str | None]]
+    blobs: dict[str, bytes]
+    #: Blob metadata (before and after) of the files that were not read
+    #: because of the size policies (`max_size` hook option).
+    skipped_files: dict[
+        str, tuple[BlobMetadata | None, BlobMetadata | None]
+    ] = dataclasses.field(default_factory=dict)
+    #: Pull request that the run was triggered for, without the token.
+    pull_request: dict[str, Any] | None = None
+    #: Versions of the tool and Python that the bundle was recorded with.
+    metadata: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_app(
+        cls,
+        app: App,
+        files: list[str],
+        file_infos: list[FileInfo],
+        skipped_files: dict[str, tuple[BlobMetadata | None, BlobMetadata | None]]
+        | None = None,
+    ) -> Bundle:
+        blobs: dict[str, bytes] = {}
+
+        def add_blob(blob: bytes | None, sha: str | None) -> str | None:
+            if blob is None:
+                return None
+            if sha is None:
+                sha = get_blob_sha(blob)
+            blobs[sha] = blob
+            return sha
+
+        file_blobs = {
+            file_info.filename: (
+                add_blob(file_info.blob_before, file_info.sha_before),
+                add_blob(file_info.blob_after, file_info.sha_after),
+            )
+            for file_info in file_infos
+        }
+        pull_request = None
+        if app.pr_info is not None:
+            pull_request = {
+                "repo_full_name": app.pr_info.repo_full_name,
+                "number": app.pr_info.number,
+                "labels": sorted(app.pr_info.labels),
+            }
+        return cls(
+            base_ref=app.base_ref,
+            head_ref=app.head_ref,
+            options={
+                key: value
+                for key, value in app.options.items()
+                if key not in EXCLUDED_OPTIONS
+            },
+            hook_options=app.hook_options,
+            files=files,
+            file_blobs=file_blobs,
+            blobs=blobs,
+            skipped_files=skipped_files or {},
+            pull_request=pull_request,
+            metadata={
+                "version": importlib.metadata.version("label-doconly-changes"),
+                "python": sys.version,
+            },
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Bundle:
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read(MANIFEST_NAME))
+            if manifest["format_version"] != FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported bundle format version: {manifest['format_version']}"
+                )
+            file_blobs = {
+                filename: (sha_before, sha_after)
+                for filename, (sha_before, sha_after) in manifest["file_blobs"].items()
+            }
+            blobs = {
+                sha: zf.read(f"blobs/{sha}")
+                for shas in file_blobs.values()
+                for sha in shas
+                if sha is not None
+            }
+            # bundles recorded before the size policies don't have this key
+            skipped_files = {
+                filename: (
+                    None if before is None else BlobMetadata(*before),
+                    None if after is None else BlobMetadata(*after),
+                )
+                for filename, (before, after) in manifest.get(
+                    "skipped_files", {}
+                ).items()
+            }
+        return cls(
+            base_ref=manifest["base_ref"],
+            head_ref=manifest["head_ref"],
+            options=manifest["options"],
+            hook_options=manifest["hook_options"],
+            files=manifest["files"],
+            file_blobs=file_blobs,
+            blobs=blobs,
+            skipped_files=skipped_files,
+            pull_request=manifest["pull_request"],
+            metadata=manifest["metadata"],
+        )
+
+    def write(self, path: str) -> None:
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "base_ref": self.base_ref,
+            "head_ref": self.head_ref,
+            "options": self.options,
+            "hook_options": self.hook_options,
+            "files": self.files,
+            "file_blobs": self.file_blobs,
+            "skipped_files": self.skipped_files,
+            "pull_request": self.pull_request,
+            "metadata": self.metadata,
+        }
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=4))
+            for sha, blob in self.blobs.items():
+                zf.writestr(f"blobs/{sha}", blob)
+
+    def get_file_info(self, filename: str) -> FileInfo:
+        try:
+            sha_before, sha_after = self.file_blobs[filename]
+        except KeyError:
+            raise FileNotFoundError("is not included in the bundle.") from None
+        return FileInfo(
+            filename,
+            None if sha_before is None else self.blobs[sha_before],
+            None if sha_after is None else self.blobs[sha_after],
+            sha_before=sha_before,
+            sha_after=sha_after,
+        )
+
+    def get_file_metadata(
+        self, filename: str
+    ) -> tuple[BlobMetadata | None, BlobMetadata | None]:
+        try:
+            return self.skipped_files[filename]
+        except KeyError:
+            pass
+        try:
+            file_info = self.get_file_info(filename)
+        except FileNotFoundError:
+            return None, None
+        return (
+            BlobMetadata.from_blob(file_info.blob_before, file_info.sha_before),
+            BlobMetadata.from_blob(file_info.blob_after, file_info.sha_after),
+        )
+
+    def create_app(
+        self,
+        *,
+        options: dict[str, str] | None = None,
+        hook_options: dict[str, dict[str, str]] | None = None,
+    ) -> App:
+        """
+        Create an app that reads the files from the bundle.
+
+        The passed options override the recorded ones.
+        """
+        merged_hook_options = {
+            hook_name: dict(recorded_options)
+            for hook_name, recorded_options in self.hook_options.items()
+        }
+        for hook_name, overrides in (hook_options or {}).items():
+            merged_hook_options.setdefault(hook_name, {}).update(overrides)
+        return App(
+            base_ref=self.base_ref,
+            head_ref=self.head_ref,
+            options={**self.options, **(options or {})},
+            hook_options=merged_hook_options,
+            file_info_source=self.get_file_info,
+            file_metadata_source=self.get_file_metadata,
+        )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "bundle", help="Path to a bundle recorded with LDC_RECORD_BUNDLE."
+    )
+    parser.add_argument(
+        "--sort",
+        default="cumulative",
+        help="Key by which the profile stats are sorted (see pstats.Stats.sort_stats).",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=30,
+        help="Number of functions to show in the profile stats.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        help="Path to write the raw profile data to (e.g. for use with snakeviz).",
+    )
+
+
+def main(args: argparse.Namespace) -> int:
+    bundle = Bundle.load(args.bundle)
+    options, hook_options = parse_options(os.environ)
+    app = bundle.create_app(options=options, hook_options=hook_options)
+    profiler = cProfile.Profile()
+    profiler.runcall(app._process_files, bundle.files)
+
+    if args.profile_output:
+        profiler.dump_stats(args.profile_output)
+    stats = pstats.Stats(profiler, stream=sys.stderr)
+    stats.sort_stats(args.sort).print_stats(args.limit)
+    return app.exit_code
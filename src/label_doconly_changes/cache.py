@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import shutil
+import tempfile
+import zlib
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class BlobCache:
+    """
+    Size-bounded on-disk cache of data derived from git blobs, keyed by blob SHA.
+
+    Entries are stored zlib-compressed in a directory specific to the namespace
+    and the version of the data format. Entries from other versions are treated
+    as stale and removed during eviction, together with the least recently used
+    entries exceeding the maximum size of the cache.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        namespace: str,
+        version: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ) -> None:
+        self.namespace_path = os.path.join(path, namespace)
+        self.path = os.path.join(self.namespace_path, version)
+        self.version = version
+        self.max_size = max_size
+
+    def _get_entry_path(self, sha: str) -> str:
+        return os.path.join(self.path, sha[:2], sha[2:])
+
+    def get(self, sha: str) -> bytes | None:
+        entry_path = self._get_entry_path(sha)
+        try:
+            with open(entry_path, "rb") as fp:
+                data = fp.read()
+            # mark the entry as recently used
+            os.utime(entry_path)
+        except OSError:
+            return None
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return None
+
+    def set(self, sha: str, data: bytes) -> None:
+        entry_path = self._get_entry_path(sha)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        # write to a temporary file first so that concurrent readers
+        # never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(zlib.compress(data))
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def evict(self) -> None:
+        """Remove stale entries and the least recently used entries over the limit."""
+        try:
+            versions = os.listdir(self.namespace_path)
+        except FileNotFoundError:
+            return
+        for version in versions:
+            if version != self.version:
+                shutil.rmtree(
+                    os.path.join(self.namespace_path, version), ignore_errors=True
+                )
+
+        entries: list[tuple[float, int, str]] = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                entry_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry_path)
+            total_size -= size
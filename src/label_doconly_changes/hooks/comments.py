@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import dataclasses
+import re
+
+from label_doconly_changes.app import TIME_BUDGET_EXHAUSTED_MESSAGE, App
+from label_doconly_changes.base_hooks import (
+    FileInfo,
+    Hook,
+    HookOutput,
+    HookOutputDict,
+    ProcessWatchdog,
+)
+
+_LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)?")
+_INDENT_RE = re.compile(r"[ \t]*")
+_WORD_END_RE = re.compile(r"[\w$]+$")
+
+
+class UnsupportedSyntaxError(Exception):
+    """Raised when the contents use syntax that the lexer can't handle safely."""
+
+
+@dataclasses.dataclass(frozen=True)
+class LanguageSpec:
+    #: Regular expressions matching comments.
+    comments: tuple[str, ...]
+    #: Regular expressions matching string literals.
+    strings: tuple[str, ...]
+    #: Characters that can start a comment or a string literal.
+    special_chars: str
+    #: Whether the indentation of lines is significant.
+    significant_indentation: bool = False
+    #: Regular expression matching an indicator of a block of verbatim text that
+    #: spans all following lines indented more than the line with the indicator.
+    block_indicator: str | None = None
+    #: Regular expression matching a regular expression literal. It is only tried
+    #: where an expression can start as `/` means division everywhere else.
+    regex_literal: str | None = None
+    #: Keywords after which an expression can start.
+    expression_keywords: frozenset[str] = frozenset()
+    #: Whether the language can contain JSX elements. The text inside of them
+    #: isn't lexed (e.g. `//` in `<a>http://a.com</a>` isn't a comment)
+    #: so the contents where `<` starts an expression are rejected.
+    jsx: bool = False
+    pattern: re.Pattern[str] = dataclasses.field(init=False, compare=False)
+    regex_literal_pattern: re.Pattern[str] | None = dataclasses.field(
+        init=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        parts = [
+            f"(?P<comment>{'|'.join(self.comments)})",
+            f"(?P<string>{'|'.join(self.strings)})",
+        ]
+        if self.block_indicator is not None:
+            parts.append(f"(?P<block>{self.block_indicator})")
+        parts += [
+            r"(?P<newline>\r\n|\r|\n)",
+            r"(?P<whitespace>[ \t\f\v]+)",
+            rf"(?P<code>[^\s{re.escape(self.special_chars)}]+|.)",
+        ]
+        object.__setattr__(self, "pattern", re.compile("|".join(parts)))
+        object.__setattr__(
+            self,
+            "regex_literal_pattern",
+            None if self.regex_literal is None else re.compile(self.regex_literal),
+        )
+
+    def can_start_expression(self, previous_token: str | None, kind: str) -> bool:
+        """
+        Check whether an expression can start after the passed token.
+
+        This errs on the side of an expression as a regular expression literal
+        is kept verbatim while a misdetected division can hide a code change
+        behind a comment-like sequence.
+        """
+        if previous_token is None:
+            return True
+        if kind != "code":
+            return False
+        if previous_token[-1] in ")]":
+            return False
+        match = _WORD_END_RE.search(previous_token)
+        if match is None:
+            return True
+        return match.group() in self.expression_keywords
+
+
+# All patterns of comments and strings that can span multiple lines also match
+# when they are not terminated so that the rest of the contents isn't rescanned
+# at each later occurrence of their start, which would take quadratic time.
+# An unterminated string is kept as a single (verbatim) token while
+# an unterminated block comment is rejected.
+_BLOCK_COMMENT = r"/\*[\s\S]*?(?:\*/|\Z)"
+_C_LIKE_COMMENTS = (_BLOCK_COMMENT, r"//[^\r\n]*")
+_DOUBLE_QUOTED_STRING = r'"[^"\\\r\n]*(?:\\[\s\S][^"\\\r\n]*)*(?:"|(?![^\r\n]))'
+_SINGLE_QUOTED_STRING = r"'[^'\\\r\n]*(?:\\[\s\S][^'\\\r\n]*)*(?:'|(?![^\r\n]))"
+
+C = LanguageSpec(
+    # line comments in C can be continued with a backslash
+    comments=(_BLOCK_COMMENT, r"//[^\r\n\\]*(?:\\[\s\S][^\r\n\\]*)*"),
+    strings=(_DOUBLE_QUOTED_STRING, _SINGLE_QUOTED_STRING),
+    special_chars="/\"'",
+)
+JS = LanguageSpec(
+    comments=_C_LIKE_COMMENTS,
+    strings=(
+        _DOUBLE_QUOTED_STRING,
+        _SINGLE_QUOTED_STRING,
+        r"`[^`\\]*(?:\\[\s\S][^`\\]*)*(?:`|\Z)",
+    ),
+    special_chars="/\"'`",
+    # the first character can't be `*` or `/` as those would start a comment
+    regex_literal=(
+        r"/(?![*/])(?:[^\\/\[\r\n]|\\[^\r\n]|\[(?:[^\]\\\r\n]|\\[^\r\n])*\])+/[\w$]*"
+    ),
+    expression_keywords=frozenset(
+        (
+            "await",
+            "case",
+            "delete",
+            "do",
+            "else",
+            "in",
+            "instanceof",
+            "new",
+            "of",
+            "return",
+            "throw",
+            "typeof",
+            "void",
+            "yield",
+        )
+    ),
+    jsx=True,
+)
+GO = LanguageSpec(
+    comments=_C_LIKE_COMMENTS,
+    strings=(_DOUBLE_QUOTED_STRING, _SINGLE_QUOTED_STRING, r"`[^`]*(?:`|\Z)"),
+    special_chars="/\"'`",
+)
+YAML = LanguageSpec(
+    comments=(r"(?<!\S)#[^\r\n]*",),
+    strings=(
+        r'(?<![^\s\[{,])"[^"\\]*(?:\\[\s\S][^"\\]*)*(?:"|\Z)',
+        r"(?<![^\s\[{,])'[^']*(?:''[^']*)*(?:'|\Z)",
+    ),
+    special_chars="#\"'|>",
+    significant_indentation=True,
+    block_indicator=r"(?<!\S)[|>][0-9+-]*(?=[ \t]|\r|\n|$)",
+)
+TOML = LanguageSpec(
+    comments=(r"#[^\r\n]*",),
+    strings=(
+        r'"""(?:[^\\]|\\[\s\S])*?(?:"""|\Z)',
+        r"'''[\s\S]*?(?:'''|\Z)",
+        _DOUBLE_QUOTED_STRING,
+        r"'[^'\r\n]*'",
+    ),
+    special_chars="#\"'",
+)
+
+
+def strip_comments(contents: str, language: LanguageSpec) -> list[str]:
+    """
+    Tokenize the passed contents, dropping the comments.
+
+    Runs of whitespace (including the ones left by removed comments) are normalized
+    to a single space, trailing whitespace and blank lines are dropped, and leading
+    whitespace is only kept, if the language's indentation is significant.
+
+    The returned tokens of two files are equal if the files only differ in comments
+    and insignificant whitespace.
+    """
+    pattern = language.pattern
+    regex_literal_pattern = language.regex_literal_pattern
+    tokens: list[str] = []
+    pos = 0
+    end = len(contents)
+    line_has_content = False
+    pending_whitespace = False
+    indent = ""
+    block_indent: int | None = None
+    previous_token: str | None = None
+    previous_kind = ""
+    while pos < end:
+        match = None
+        if (
+            regex_literal_pattern is not None
+            and contents[pos] == "/"
+            and language.can_start_expression(previous_token, previous_kind)
+        ):
+            match = regex_literal_pattern.match(contents, pos)
+        if match is not None:
+            kind = "regex_literal"
+        else:
+            match = pattern.match(contents, pos)
+            assert match is not None
+            kind = match.lastgroup or ""
+        text = match.group()
+        pos = match.end()
+
+        if kind == "newline":
+            if line_has_content:
+                tokens.append(text)
+            line_has_content = False
+            pending_whitespace = False
+            indent = ""
+            if block_indent is not None:
+                # consume all blank lines and lines that are indented more than
+                # the line with the block indicator as a single verbatim token
+                block_start = pos
+                while pos < end:
+                    line_match = _LINE_RE.match(contents, pos)
+                    assert line_match is not None
+                    line = line_match.group()
+                    line_indent = len(_INDENT_RE.match(line).group())  # type: ignore
+                    if line.strip() and line_indent <= block_indent:
+                        break
+                    pos = line_match.end()
+                if block_start != pos:
+                    tokens.append(contents[block_start:pos])
+                block_indent = None
+            continue
+
+        if kind == "comment" and text.startswith("/*"):
+            if len(text) < 4 or not text.endswith("*/"):
+                raise UnsupportedSyntaxError("unterminated block comment")
+
+        if kind in ("comment", "whitespace"):
+            if not line_has_content and kind == "whitespace":
+                indent = text
+            else:
+                pending_whitespace = True
+            continue
+
+        if (
+            language.jsx
+            and kind == "code"
+            and text[0] == "<"
+            and language.can_start_expression(previous_token, previous_kind)
+        ):
+            raise UnsupportedSyntaxError("JSX elements are not supported")
+
+        if not line_has_content:
+            if language.significant_indentation:
+                tokens.append(indent)
+            line_has_content = True
+        elif pending_whitespace:
+            tokens.append(" ")
+        pending_whitespace = False
+        tokens.append(text)
+        previous_token = text
+        previous_kind = kind
+        if kind == "block":
+            block_indent = len(indent)
+
+    return tokens
+
+
+def find_non_comment_change(
+    contents_before: bytes, contents_after: bytes, language: LanguageSpec
+) -> str | None:
+    """
+    Find a change in the file that is not a comment change.
+
+    Returns a description of the found change or None, if there is no such change.
+    """
+    try:
+        source_before = contents_before.decode("utf-8")
+        source_after = contents_after.decode("utf-8")
+    except UnicodeDecodeError:
+        return "contains non-comment changes (cannot decode)."
+    try:
+        if strip_comments(source_before, language) == strip_comments(
+            source_after, language
+        ):
+            return None
+    except UnsupportedSyntaxError as exc:
+        return f"can't be analyzed: {exc}."
+    return "contains non-comment changes."
+
+
+class CommentsHook(Hook):
+    def __init__(
+        self,
+        module_name: str,
+        subhook_name: str = "",
+        *,
+        file_patterns: tuple[str, ...],
+        language: LanguageSpec,
+    ) -> None:
+        super().__init__(module_name, subhook_name, file_patterns=file_patterns)
+        self.language = language
+
+    def run(self, app: App, file_data: list[FileInfo]) -> HookOutputDict:
+        hook_output = HookOutput()
+        with ProcessWatchdog() as watchdog:
+            for file_info in file_data:
+                filename = file_info.filename
+                if file_info.blob_before is None:
+                    hook_output.fail(filename, "only exists on the head branch.")
+                    continue
+                if file_info.blob_after is None:
+                    hook_output.fail(filename, "only exists on the base branch.")
+                    continue
+                if file_info.is_unchanged:
+                    hook_output.success(filename, "contains only comment changes.")
+                    continue
+
+                # files are only analyzed in a separate (killable) process
+                # when there's a time limit
+                timeout = app.get_file_timeout(self)
+                try:
+                    reason = watchdog.call(
+                        find_non_comment_change,
+                        file_info.blob_before,
+                        file_info.blob_after,
+                        self.language,
+                        timeout=timeout,
+                    )
+                except TimeoutError:
+                    if timeout:
+                        hook_output.fail(
+                            filename, f"timed out after {timeout:g} seconds."
+                        )
+                    else:
+                        hook_output.fail(filename, TIME_BUDGET_EXHAUSTED_MESSAGE)
+                    continue
+                if reason is None:
+                    hook_output.success(filename, "contains only comment changes.")
+                else:
+                    hook_output.fail(filename, reason)
+
+        return hook_output.to_json()
+
+
+AVAILABLE_HOOKS = [
+    CommentsHook(__name__, "c", file_patterns=("*.c", "*.h"), language=C),
+    CommentsHook(
+        __name__, "js", file_patterns=("*.js", "*.mjs", "*.cjs", "*.ts"), language=JS
+    ),
+    CommentsHook(__name__, "go", file_patterns=("*.go",), language=GO),
+    CommentsHook(__name__, "yaml", file_patterns=("*.yaml", "*.yml"), language=YAML),
+    CommentsHook(__name__, "toml", file_patterns=("*.toml",), language=TOML),
+]
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import json
+import re
+from collections.abc import Iterator
+from typing import NamedTuple
+
+import libcst as cst
+
+from label_doconly_changes.app import TIME_BUDGET_EXHAUSTED_MESSAGE, App
+from label_doconly_changes.base_hooks import (
+    FileInfo,
+    Hook,
+    HookOutput,
+    HookOutputDict,
+    ProcessWatchdog,
+    get_blob_sha,
+)
+from label_doconly_changes.cache import BlobCache
+from label_doconly_changes.hooks.python import ExtractorCache, is_docstring_only_change
+
+_WHITESPACE_RE = re.compile(rb"[ \t\n\r]*")
+# unrolled so that runs of unescaped characters are matched in a single step
+_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_STRUCTURAL_CHAR_RE = re.compile(rb'["\[\]{}]')
+_SCALAR_RE = re.compile(rb"[^,\]}\s]+")
+
+
+class NotebookError(Exception):
+    """Raised when the contents can't be read as a notebook."""
+
+
+class Cell(NamedTuple):
+    cell_type: str
+    #: Start and end byte offset of the JSON-encoded source of the cell.
+    source_span: tuple[int, int]
+
+
+class NotebookScanner:
+    """
+    Incremental scanner of the notebook's UTF-8 encoded JSON document.
+
+    The document is scanned as bytes (no byte of a multi-byte UTF-8 sequence
+    can be mistaken for a JSON structural character) and only the object keys,
+    cell types, and sources are decoded. All other values (outputs, attachments,
+    metadata) are skipped over without being decoded.
+    """
+
+    def __init__(self, contents: bytes) -> None:
+        self.contents = contents
+        self.pos = 0
+
+    def _skip_whitespace(self) -> None:
+        self.pos = _WHITESPACE_RE.match(self.contents, self.pos).end()  # type: ignore
+
+    def _peek(self) -> bytes:
+        self._skip_whitespace()
+        return self.contents[self.pos : self.pos + 1]
+
+    def _expect(self, char: bytes) -> None:
+        if self._peek() != char:
+            raise NotebookError(f"Expected {char.decode()!r} at offset {self.pos}.")
+        self.pos += 1
+
+    def _skip_string(self) -> None:
+        match = _STRING_RE.match(self.contents, self.pos)
+        if match is None:
+            raise NotebookError(f"Unterminated string at offset {self.pos}.")
+        self.pos = match.end()
+
+    def _read_string(self) -> str:
+        start = self.pos
+        self._skip_string()
+        return json.loads(self.contents[start : self.pos])
+
+    def _skip_value(self) -> None:
+        char = self._peek()
+        if char == b'"':
+            self._skip_string()
+            return
+        if char not in (b"[", b"{"):
+            match = _SCALAR_RE.match(self.contents, self.pos)
+            if match is None:
+                raise NotebookError(f"Expected a value at offset {self.pos}.")
+            self.pos = match.end()
+            return
+
+        depth = 0
+        while True:
+            match = _STRUCTURAL_CHAR_RE.search(self.contents, self.pos)
+            if match is None:
+                raise NotebookError("Unexpected end of the document.")
+            self.pos = match.start()
+            char = match.group()
+            if char == b'"':
+                self._skip_string()
+                continue
+            self.pos += 1
+            if char in (b"[", b"{"):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _iter_object_keys(self) -> Iterator[str]:
+        """
+        Iterate over the keys of the object at the current position.
+
+        The position is left at the key's value, which needs to be consumed
+        before the next key is requested.
+        """
+        self._expect(b"{")
+        if self._peek() == b"}":
+            self.pos += 1
+            return
+        while True:
+            if self._peek() != b'"':
+                raise NotebookError(f"Expected an object key at offset {self.pos}.")
+            key = self._read_string()
+            self._expect(b":")
+            self._skip_whitespace()
+            yield key
+            if self._peek() == b",":
+                self.pos += 1
+                continue
+            self._expect(b"}")
+            return
+
+    def _iter_array(self) -> Iterator[None]:
+        self._expect(b"[")
+        if self._peek() == b"]":
+            self.pos += 1
+            return
+        while True:
+            self._skip_whitespace()
+            yield
+            if self._peek() == b",":
+                self.pos += 1
+                continue
+            self._expect(b"]")
+            return
+
+    def _read_cell(self) -> Cell:
+        cell_type = None
+        source_span = None
+        for key in self._iter_object_keys():
+            if key == "cell_type":
+                cell_type = self._read_string()
+            elif key == "source":
+                start = self.pos
+                self._skip_value()
+                source_span = (start, self.pos)
+            else:
+                self._skip_value()
+        if cell_type is None or source_span is None:
+            raise NotebookError("Cell is missing the cell type or the source.")
+        return Cell(cell_type, source_span)
+
+    def iter_cells(self) -> Iterator[Cell]:
+        found_cells = False
+        for key in self._iter_object_keys():
+            if key != "cells":
+                self._skip_value()
+                continue
+            found_cells = True
+            for _ in self._iter_array():
+                yield self._read_cell()
+        if not found_cells:
+            raise NotebookError("Only notebooks in nbformat 4+ are supported.")
+
+    def get_source(self, cell: Cell) -> str:
+        start, end = cell.source_span
+        source = json.loads(self.contents[start:end])
+        if isinstance(source, list):
+            return "".join(source)
+        return source
+
+
+def find_non_doc_change(
+    contents_before: bytes,
+    contents_after: bytes,
+    *,
+    cache: ExtractorCache | None = None,
+) -> str | None:
+    """
+    Find a change in the notebook that is not a documentation change.
+
+    Changes to markdown cells, outputs, attachments, and metadata are considered
+    documentation changes. Code cells are only allowed to have docstring changes.
+
+    If the cache is passed, the parsed code cells are retrieved from/stored in it.
+
+    Returns a description of the found change or None, if there is no such change.
+    """
+    if contents_before == contents_after:
+        return None
+    before = NotebookScanner(contents_before)
+    after = NotebookScanner(contents_after)
+    before_cells = (
+        cell for cell in before.iter_cells() if cell.cell_type != "markdown"
+    )
+    after_cells = (cell for cell in after.iter_cells() if cell.cell_type != "markdown")
+    sentinel = Cell("", (0, 0))
+    while True:
+        b = next(before_cells, sentinel)
+        a = next(after_cells, sentinel)
+        if b is sentinel and a is sentinel:
+            return None
+        if b.cell_type != a.cell_type:
+            return "adds, removes, or changes type of a non-markdown cell."
+
+        source_before = before.get_source(b)
+        source_after = after.get_source(a)
+        if source_before == source_after:
+            continue
+        if b.cell_type != "code":
+            return f"contains changes to a {b.cell_type} cell."
+        try:
+            if not is_docstring_only_change(
+                source_before,
+                source_after,
+                cache=cache,
+                sha_before=get_blob_sha(source_before.encode()),
+                sha_after=get_blob_sha(source_after.encode()),
+            ):
+                return "contains non-docstring changes in a code cell."
+        except cst.ParserSyntaxError as exc:
+            return f"contains changes to a code cell that can't be parsed: {exc}"
+
+
+def _find_non_doc_change_in_worker(
+    contents_before: bytes, contents_after: bytes, blob_cache: BlobCache | None
+) -> str | None:
+    return find_non_doc_change(
+        contents_before, contents_after, cache=ExtractorCache(blob_cache)
+    )
+
+
+class JupyterHook(Hook):
+    def run(self, app: App, file_data: list[FileInfo]) -> HookOutputDict:
+        hook_output = HookOutput()
+        cache = ExtractorCache.from_app(app)
+        with ProcessWatchdog() as watchdog:
+            for file_info in file_data:
+                filename = file_info.filename
+                if file_info.blob_before is None:
+                    hook_output.fail(filename, "only exists on the head branch.")
+                    continue
+                if file_info.blob_after is None:
+                    hook_output.fail(filename, "only exists on the base branch.")
+                    continue
+                if file_info.is_unchanged:
+                    hook_output.success(
+                        filename, "contains only documentation changes."
+                    )
+                    continue
+
+                # code cells are analyzed the same way as Python files so notebooks
+                # are only analyzed in a separate (killable) process
+                # when there's a time limit
+                timeout = app.get_file_timeout(self)
+                try:
+                    if timeout is None:
+                        reason = find_non_doc_change(
+                            file_info.blob_before, file_info.blob_after, cache=cache
+                        )
+                    else:
+                        reason = watchdog.call(
+                            _find_non_doc_change_in_worker,
+                            file_info.blob_before,
+                            file_info.blob_after,
+                            cache.blob_cache,
+                            timeout=timeout,
+                        )
+                except TimeoutError:
+                    if timeout:
+                        hook_output.fail(
+                            filename, f"timed out after {timeout:g} seconds."
+                        )
+                    else:
+                        hook_output.fail(filename, TIME_BUDGET_EXHAUSTED_MESSAGE)
+                    continue
+                except (NotebookError, ValueError) as exc:
+                    hook_output.fail(filename, f"is not a valid notebook: {exc}")
+                    continue
+                if reason is None:
+                    hook_output.success(
+                        filename, "contains only documentation changes."
+                    )
+                else:
+                    hook_output.fail(filename, reason)
+
+        return hook_output.to_json()
+
+
+AVAILABLE_HOOKS = [JupyterHook(__name__, file_patterns=("*.ipynb",))]
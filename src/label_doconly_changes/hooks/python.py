@@ -1,19 +1,34 @@
 from __future__ import annotations
 
+import concurrent.futures
 import dataclasses
 import enum
+import importlib.metadata
+import io
 import itertools
 import os
+import pickle
+import sys
+import time
+import tokenize
 from collections import deque
 from collections.abc import Iterator, Sequence
-from typing import Generic, Literal, NamedTuple, Self, TypeVar
+from typing import Any, Generic, Literal, NamedTuple, Self, TypeVar
 
 import libcst as cst
 
-from label_doconly_changes.app import App
-from label_doconly_changes.base_hooks import FileInfo, Hook, HookOutput, HookOutputDict
-
-os.environ["LIBCST_PARSER_TYPE"] = "native"
+from label_doconly_changes.app import TIME_BUDGET_EXHAUSTED_MESSAGE, App
+from label_doconly_changes.base_hooks import (
+    FileInfo,
+    Hook,
+    HookOutput,
+    HookOutputDict,
+    MessageType,
+    ProcessWatchdog,
+    get_blob_sha,
+    get_mp_context,
+)
+from label_doconly_changes.cache import BlobCache
 
 _DocstringTarget = cst.Module | cst.ClassDef | cst.FunctionDef
 _NodeT = TypeVar("_NodeT", bound=cst.CSTNode)
@@ -22,6 +37,11 @@ _ExprT = TypeVar("_ExprT")
 # ensure consistent default to avoid false positives
 # caused by parser's detection mechanism for this value
 PARSER_CONFIG = cst.PartialParserConfig(default_newline="\n")
+#: Default size (in characters) of the modules above which they are analyzed
+#: in chunks by multiple processes.
+DEFAULT_SPLIT_THRESHOLD = 1024 * 1024
+#: Number of chunks per CPU that the split modules are divided into.
+CHUNKS_PER_CPU = 4
 
 
 class DocstringLocation(NamedTuple, Generic[_ExprParentT, _ExprT]):
@@ -87,6 +107,14 @@ class DocstringExtractor(NodeListGenerator):
     def __init__(self, module: cst.Module) -> None:
         super().__init__(module)
         self.doc_locations: dict[_DocstringTarget, _DocstringLocation] = {}
+        #: Index (in the node list) right after the subtree of each `EmptyLine` node,
+        #: used to skip the leading lines of statements without traversing them.
+        self.empty_line_ends: dict[cst.EmptyLine, int] = {}
+
+    def on_leave(self, original_node: cst.CSTNode) -> None:
+        if type(original_node) is cst.EmptyLine:
+            self.empty_line_ends[original_node] = len(self.nodes)
+        super().on_leave(original_node)
 
     def visit_Module(self, node: cst.Module) -> None:
         self.doc_locations[node] = self.extract_docstring(node)
@@ -128,13 +156,45 @@ class DocstringExtractor(NodeListGenerator):
         return DocstringLocation(parent, expr)
 
 
+@dataclasses.dataclass(slots=True)
+class AnalyzerCounters:
+    """Counters of the work done by `PythonAnalyzer`."""
+
+    #: Number of compared node pairs.
+    comparisons: int = 0
+    #: Number of node pairs that weren't compared (contents of the docstrings).
+    skipped_comparisons: int = 0
+    #: Number of the modules, classes, and functions entered by both trees.
+    docstring_targets: int = 0
+    docstring_additions: int = 0
+    docstring_removals: int = 0
+
+
+def _get_node_info(
+    extractor: DocstringExtractor, node: cst.CSTNode | None
+) -> dict[str, Any] | None:
+    """Get the type and the (1-based) start position of the module's node."""
+    if node is None:
+        return None
+    wrapper = cst.MetadataWrapper(extractor.base_node, unsafe_skip_copy=True)
+    positions = wrapper.resolve(cst.metadata.PositionProvider)
+    info: dict[str, Any] = {"type": type(node).__name__, "line": None, "column": None}
+    if (position := positions.get(node)) is not None:
+        info["line"] = position.start.line
+        info["column"] = position.start.column + 1
+    return info
+
+
 class NodeIterator(Iterator[cst.CSTNode]):
     def __init__(self, nodes: list[cst.CSTNode], *, name: str | None = None) -> None:
         self.name = name
         self.additional_nodes: deque[cst.CSTNode] = deque()
         self.current = -1
+        #: Index of the next node to return.
+        self.index = 0
+        #: Number of the nodes skipped with `jump()`.
+        self.skipped = 0
         self.nodes = nodes
-        self.nodes_it = enumerate(nodes)
 
     def __repr__(self) -> str:
         return f"<NodeIterator {self.name!r} current={self.current!r}>"
@@ -145,13 +205,24 @@ class NodeIterator(Iterator[cst.CSTNode]):
     def __next__(self) -> cst.CSTNode:
         if self.additional_nodes:
             return self.additional_nodes.popleft()
-        self.current, node = next(self.nodes_it)
-        return node
+        if self.index >= len(self.nodes):
+            raise StopIteration
+        self.current = self.index
+        self.index += 1
+        return self.nodes[self.current]
+
+    def jump(self, index: int) -> None:
+        """Skip the nodes before the passed index."""
+        self.skipped += index - self.index
+        self.current = index - 1
+        self.index = index
 
 
 class ModuleTracker:
-    def __init__(self, contents: str, *, name: Literal["before", "after"]) -> None:
-        self.extractor = DocstringExtractor.from_contents(contents)
+    def __init__(
+        self, extractor: DocstringExtractor, *, name: Literal["before", "after"]
+    ) -> None:
+        self.extractor = extractor
         self.it = NodeIterator(self.extractor.nodes, name=name)
         self.loc: _DocstringLocation = DocstringLocation(None, None)
 
@@ -162,8 +233,24 @@ class ModuleTracker:
 
 class PythonAnalyzer:
     def __init__(self, contents_before: str, contents_after: str) -> None:
-        self.before = ModuleTracker(contents_before, name="before")
-        self.after = ModuleTracker(contents_after, name="after")
+        self._init_trackers(
+            DocstringExtractor.from_contents(contents_before),
+            DocstringExtractor.from_contents(contents_after),
+        )
+
+    @classmethod
+    def from_extractors(
+        cls, before: DocstringExtractor, after: DocstringExtractor
+    ) -> Self:
+        self = cls.__new__(cls)
+        self._init_trackers(before, after)
+        return self
+
+    def _init_trackers(
+        self, before: DocstringExtractor, after: DocstringExtractor
+    ) -> None:
+        self.before = ModuleTracker(before, name="before")
+        self.after = ModuleTracker(after, name="after")
         self.it = itertools.zip_longest(self.before.it, self.after.it)
         #: Count of the docstring expressions in the currently tracked docstring target.
         #: 0 means that there's no currently tracked docstring target (which can mean
@@ -172,11 +259,17 @@ class PythonAnalyzer:
         self.expr_count = 0
         #: Determines if the next single comparison should be skipped.
         self.skip_compare = False
+        self.counters = AnalyzerCounters()
+        #: Nodes (before and after) at which the trees diverged, if they did.
+        #: None is used for the side that ran out of nodes.
+        self.divergence: tuple[cst.CSTNode | None, cst.CSTNode | None] | None = None
 
     def is_docstring_only(self) -> bool:
+        counters = self.counters
         for b, a in self.it:
             # The zipped iterators should both end at the same time.
             if b is None or a is None:
+                self.divergence = (b, a)
                 return False
 
             if (ret := self._handle_docstring_addition_and_removal(b, a)) is False:
@@ -186,8 +279,12 @@ class PythonAnalyzer:
 
             if self.skip_compare:
                 self.skip_compare = False
-            elif not shallow_equals(b, a):
-                return False
+                counters.skipped_comparisons += 1
+            else:
+                counters.comparisons += 1
+                if not shallow_equals(b, a):
+                    self.divergence = (b, a)
+                    return False
 
             # If both docstring targets have a docstring, we don't want to compare their
             # contents so we set skip_compare when we see the docstring's Expr node.
@@ -200,6 +297,28 @@ class PythonAnalyzer:
 
         return True
 
+    def get_stats(self) -> dict[str, Any]:
+        """
+        Get the statistics of the analysis (after `is_docstring_only()` was called).
+
+        Positions of the nodes at which the trees diverged are only computed here,
+        the analysis itself doesn't need them.
+        """
+        stats: dict[str, Any] = {}
+        for tracker in (self.before, self.after):
+            it = tracker.it
+            stats[f"nodes_{it.name}"] = len(it.nodes)
+            stats[f"visited_{it.name}"] = it.index - it.skipped
+            stats[f"skipped_{it.name}"] = it.skipped
+        stats.update(dataclasses.asdict(self.counters))
+        stats["first_divergence"] = None
+        if self.divergence is not None:
+            stats["first_divergence"] = {
+                tracker.it.name: _get_node_info(tracker.extractor, node)
+                for tracker, node in zip((self.before, self.after), self.divergence)
+            }
+        return stats
+
     def _handle_docstring_addition_and_removal(
         self, b: cst.CSTNode, a: cst.CSTNode
     ) -> bool | ContinueSentinel:
@@ -214,11 +333,13 @@ class PythonAnalyzer:
             b = self._consume_docstring_with_whitespace(
                 self.before.it, self.before.loc.expr
             )
+            self.counters.docstring_removals += 1
         elif a is self.after.loc.expr_parent:
             assert self.after.loc.expr_parent is not None
             a = self._consume_docstring_with_whitespace(
                 self.after.it, self.after.loc.expr
             )
+            self.counters.docstring_additions += 1
         else:
             return True
         self.expr_count = 0
@@ -234,18 +355,18 @@ class PythonAnalyzer:
         self.before.it.additional_nodes.appendleft(b)
         self.after.it.additional_nodes.appendleft(a)
         for b, a in self.it:
-            if b is None or a is None:
-                return False
-            if not shallow_equals(b, a):
+            self.counters.comparisons += 1
+            if b is None or a is None or not shallow_equals(b, a):
+                self.divergence = (b, a)
                 return False
             if isinstance(b, (cst.SimpleStatementLine, cst.BaseCompoundStatement)):
                 break
         else:
             raise RuntimeError("Couldn't find a statement node.")
 
-        self._consume_leading_lines(b, self.before.it)
+        self._consume_leading_lines(b, self.before)
         # b and a must have same types here due to earlier shallow_equals() call
-        self._consume_leading_lines(a, self.after.it)  # type: ignore
+        self._consume_leading_lines(a, self.after)  # type: ignore
 
         return ContinueSentinel.CONTINUE
 
@@ -254,6 +375,7 @@ class PythonAnalyzer:
         if type(b) in valid_classes:
             assert isinstance(a, valid_classes)
             assert isinstance(b, valid_classes)
+            self.counters.docstring_targets += 1
             self.before.loc = self.before.extractor.doc_locations[b]
             self.after.loc = self.after.extractor.doc_locations[a]
             self.expr_count = self.before.has_docstring + self.after.has_docstring
@@ -263,9 +385,9 @@ class PythonAnalyzer:
             # we don't want to consume them in _handle_docstring_addition_and_removal().
             if self.expr_count == 1 and type(b) is cst.Module:
                 if self.before.loc.expr_parent is None:
-                    self._consume_leading_lines(b, self.before.it)
+                    self._consume_leading_lines(b, self.before)
                 else:
-                    self._consume_leading_lines(a, self.after.it)
+                    self._consume_leading_lines(a, self.after)
 
         return False
 
@@ -316,11 +438,11 @@ class PythonAnalyzer:
     @staticmethod
     def _consume_leading_lines(
         statement: cst.Module | cst.SimpleStatementLine | cst.BaseCompoundStatement,
-        iterator: NodeIterator,
+        tracker: ModuleTracker,
     ) -> None:
         """
-        Consume passed statement's leading lines from the iterator, excluding comments
-        (which are added to iterator's additional nodes).
+        Consume passed statement's leading lines from the tracker's iterator,
+        excluding comments (which are added to iterator's additional nodes).
 
         If the passed `statement` is a Module node, `header` attribute is used
         instead of `leading_lines`.
@@ -329,44 +451,688 @@ class PythonAnalyzer:
             leading_lines = statement.header
         else:
             leading_lines = statement.leading_lines
+        if not leading_lines:
+            return
+
+        # The subtrees of the leading lines are next to each other in the node list
+        # so they can be skipped at once, if the iterator is at the first one.
+        iterator = tracker.it
+        if (
+            iterator.additional_nodes
+            or iterator.index >= len(iterator.nodes)
+            or iterator.nodes[iterator.index] is not leading_lines[0]
+        ):
+            raise RuntimeError("Expected leading line is missing.")
+        iterator.jump(tracker.extractor.empty_line_ends[leading_lines[-1]])
+        iterator.additional_nodes.extend(
+            line.comment for line in leading_lines if line.comment is not None
+        )
+
+
+_IGNORED_TOKEN_TYPES = frozenset(
+    (
+        tokenize.COMMENT,
+        tokenize.NL,
+        tokenize.NEWLINE,
+        tokenize.INDENT,
+        tokenize.DEDENT,
+        tokenize.ENCODING,
+        tokenize.ENDMARKER,
+    )
+)
 
-        additional_nodes = []
-        for base_node in leading_lines:
-            for node in NodeListGenerator.from_node(base_node).nodes:
-                if node is not next(iterator, None):
-                    raise RuntimeError("Expected leading line is missing.")
-                if type(node) is cst.Comment:
-                    additional_nodes.append(node)
-        iterator.additional_nodes.extend(additional_nodes)
 
+def _split_lines(contents: str) -> list[str]:
+    # Only "\n" is treated as a line separator here, other line endings
+    # result in error tokens which make the token-level classification bail out.
+    lines = contents.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
 
-class PythonHook(Hook):
-    def run(self, app: App, file_data: list[FileInfo]) -> HookOutputDict:
-        hook_output = HookOutput()
-        for file_info in file_data:
-            if file_info.contents_before is None:
-                hook_output.fail(file_info.filename, "only exists on the head branch.")
+
+def _is_docstring_token(token: tokenize.TokenInfo) -> bool:
+    if token.type != tokenize.STRING:
+        return False
+    prefix = token.string[: token.string.index(token.string[-1])]
+    return "f" not in prefix.lower()
+
+
+class TokenSummary:
+    """
+    Token-level summary of a module used for classifying changes without parsing.
+
+    Docstring-eligible statements (first statements of a module, class, or function
+    body that consist only of string literals) are excluded from `significant_tokens`
+    and, if they consist of a single string token, cut out from `code_pieces`.
+    """
+
+    __slots__ = ("significant_tokens", "code_pieces")
+
+    def __init__(
+        self, significant_tokens: list[tuple[int, str]], code_pieces: list[str]
+    ) -> None:
+        self.significant_tokens = significant_tokens
+        self.code_pieces = code_pieces
+
+    @classmethod
+    def from_contents(cls, contents: str) -> TokenSummary | None:
+        """
+        Create a summary of the passed module contents.
+
+        Returns None, if the module can't be reliably classified at the token level.
+        """
+        lines = _split_lines(contents)
+        line_offsets = list(itertools.accumulate(map(len, lines), initial=0))
+        try:
+            tokens = list(tokenize.generate_tokens(iter(lines).__next__))
+        except (tokenize.TokenError, SyntaxError):
+            return None
+
+        significant_tokens: list[tuple[int, str]] = []
+        docstring_spans: list[tuple[int, int]] = []
+        depth = 0
+        in_header = False
+        # Whether we're waiting for the first statement of a body
+        # which can be a docstring. Module's body starts right away.
+        at_body_start = True
+        # Tokens of the statement that can turn out to be a docstring.
+        candidate: list[tokenize.TokenInfo] | None = None
+        for token in tokens:
+            if token.type == tokenize.ERRORTOKEN:
+                return None
+            if token.type == tokenize.OP:
+                if token.string in "([{":
+                    depth += 1
+                elif token.string in ")]}":
+                    depth -= 1
+
+            if at_body_start:
+                if token.type in _IGNORED_TOKEN_TYPES:
+                    continue
+                at_body_start = False
+                if _is_docstring_token(token) or token.string == "(":
+                    candidate = [token]
+                    continue
+
+            to_process = [token]
+            if candidate is not None:
+                if token.type == tokenize.NEWLINE and any(
+                    t.type == tokenize.STRING for t in candidate
+                ):
+                    if len(candidate) == 1:
+                        start_row, start_col = candidate[0].start
+                        end_row, end_col = candidate[0].end
+                        docstring_spans.append(
+                            (
+                                line_offsets[start_row - 1] + start_col,
+                                line_offsets[end_row - 1] + end_col,
+                            )
+                        )
+                    candidate = None
+                    continue
+                if token.type in (tokenize.NL, tokenize.COMMENT):
+                    continue
+                if _is_docstring_token(token) or token.string in ("(", ")"):
+                    candidate.append(token)
+                    continue
+                if token.string == ";":
+                    # Semicolon-separated statements make the docstring handling
+                    # at the token level ambiguous.
+                    return None
+                to_process = [*candidate, token]
+                candidate = None
+
+            for t in to_process:
+                if t.type in _IGNORED_TOKEN_TYPES:
+                    continue
+                significant_tokens.append((t.type, t.string))
+                if t.type == tokenize.NAME and t.string in ("def", "class"):
+                    in_header = True
+                elif in_header and t.string == ":" and depth == 0:
+                    in_header = False
+                    at_body_start = True
+
+        code_pieces = []
+        last_end = 0
+        for start, end in docstring_spans:
+            code_pieces.append(contents[last_end:start])
+            last_end = end
+        code_pieces.append(contents[last_end:])
+
+        return cls(significant_tokens, code_pieces)
+
+
+def classify_by_tokens(contents_before: str, contents_after: str) -> bool | None:
+    """
+    Classify the change without parsing the module by comparing tokens.
+
+    Returns True, if the contents outside of docstrings are identical, False,
+    if any token outside of the docstring-eligible statements differs, and None,
+    if the change can't be decided at the token level.
+    """
+    before = TokenSummary.from_contents(contents_before)
+    if before is None:
+        return None
+    after = TokenSummary.from_contents(contents_after)
+    if after is None:
+        return None
+    if before.significant_tokens != after.significant_tokens:
+        return False
+    if before.code_pieces == after.code_pieces:
+        return True
+    return None
+
+
+#: Keywords starting the clauses of compound statements which can't be split off
+#: from the preceding statement.
+_CLAUSE_KEYWORDS = frozenset(("else", "elif", "except", "finally"))
+#: Prefix of the non-header chunks which ensures that the chunk's first statement
+#: is not treated as a module docstring.
+_CHUNK_PREFIX = "pass\n"
+
+
+class TopLevelStatements(NamedTuple):
+    #: Offsets at which the top-level statements start. Decorated definitions and
+    #: the clauses of compound statements are treated as a single statement.
+    starts: list[int]
+    #: Whether the first statement can be the module's docstring.
+    has_docstring: bool
+
+    @classmethod
+    def from_contents(cls, contents: str) -> TopLevelStatements | None:
+        """
+        Find the top-level statements of the module with the tokenizer.
+
+        Returns None, if the contents can't be tokenized.
+        """
+        lines = _split_lines(contents)
+        line_offsets = list(itertools.accumulate(map(len, lines), initial=0))
+        try:
+            tokens = list(tokenize.generate_tokens(iter(lines).__next__))
+        except (tokenize.TokenError, SyntaxError):
+            return None
+
+        starts: list[int] = []
+        first_statement: list[tokenize.TokenInfo] = []
+        indent = 0
+        at_statement_start = True
+        after_decorator = False
+        for token in tokens:
+            if token.type == tokenize.ERRORTOKEN:
+                return None
+            if token.type == tokenize.INDENT:
+                indent += 1
                 continue
-            if file_info.contents_after is None:
-                hook_output.fail(file_info.filename, "only exists on the base branch.")
+            if token.type == tokenize.DEDENT:
+                indent -= 1
                 continue
+            if token.type == tokenize.NEWLINE:
+                at_statement_start = True
+                continue
+            if token.type in _IGNORED_TOKEN_TYPES:
+                continue
+
+            if at_statement_start:
+                at_statement_start = False
+                if indent == 0:
+                    if not after_decorator and token.string not in _CLAUSE_KEYWORDS:
+                        starts.append(line_offsets[token.start[0] - 1])
+                    after_decorator = token.string == "@"
+            if len(starts) == 1:
+                first_statement.append(token)
+
+        has_docstring = any(
+            token.type == tokenize.STRING for token in first_statement
+        ) and all(
+            _is_docstring_token(token) or token.string in ("(", ")")
+            for token in first_statement
+        )
+        return cls(starts, has_docstring)
+
+
+def split_modules(
+    contents_before: str, contents_after: str, *, chunk_count: int
+) -> list[tuple[str, str]] | Literal[False] | None:
+    """
+    Split both versions of the module into aligned pairs of chunks
+    at top-level statement boundaries.
+
+    The first pair is the header with the module docstring (if any), the statement
+    following it, and everything before them. The remaining statements are grouped
+    into (at most) `chunk_count` chunks of similar size. The non-header chunks are
+    prefixed with a `pass` statement so that they can be analyzed independently.
+
+    Returns False, if the modules have a different number of (non-header)
+    top-level statements, or None, if the modules can't be split.
+    """
+    before = TopLevelStatements.from_contents(contents_before)
+    if before is None:
+        return None
+    after = TopLevelStatements.from_contents(contents_after)
+    if after is None:
+        return None
+    before_header_size = 1 + before.has_docstring
+    after_header_size = 1 + after.has_docstring
+    statement_count = len(before.starts) - before_header_size
+    if statement_count != len(after.starts) - after_header_size:
+        return False
+    if statement_count <= 0:
+        return None
+
+    # the chunks are split at the same statements in both versions,
+    # the sizes of the chunks are based on the version before the change
+    ends = [*before.starts[before_header_size + 1 :], len(contents_before)]
+    first_start = before.starts[before_header_size]
+    chunk_size = (len(contents_before) - first_start) / chunk_count
+    boundaries = [0]
+    for idx, end in enumerate(ends[:-1], start=1):
+        if end - first_start >= chunk_size * len(boundaries):
+            boundaries.append(idx)
+    boundaries.append(statement_count)
+
+    def get_chunks(
+        contents: str, statements: TopLevelStatements, header_size: int
+    ) -> list[str]:
+        starts = [*statements.starts[header_size:], len(contents)]
+        chunks = [contents[: starts[0]]]
+        for start, end in itertools.pairwise(boundaries):
+            chunks.append(_CHUNK_PREFIX + contents[starts[start] : starts[end]])
+        return chunks
+
+    return list(
+        zip(
+            get_chunks(contents_before, before, before_header_size),
+            get_chunks(contents_after, after, after_header_size),
+        )
+    )
+
+
+def _check_chunk(
+    contents_before: str, contents_after: str, blob_cache: BlobCache | None
+) -> bool:
+    cache = ExtractorCache(blob_cache)
+    sha_before = get_blob_sha(contents_before.encode())
+    extractor_before = cache.get_extractor(contents_before, sha_before)
+    if contents_before == contents_after:
+        # the chunk still needs to be parsed to find syntax errors
+        return True
+    sha_after = get_blob_sha(contents_after.encode())
+    return PythonAnalyzer.from_extractors(
+        extractor_before, cache.get_extractor(contents_after, sha_after)
+    ).is_docstring_only()
+
+
+def is_docstring_only_change_by_chunks(
+    contents_before: str,
+    contents_after: str,
+    *,
+    executor: concurrent.futures.Executor,
+    chunk_count: int,
+    blob_cache: BlobCache | None = None,
+) -> bool | None:
+    """
+    Check whether the passed module contents differ only in docstrings by analyzing
+    the aligned chunks of the modules (see `split_modules()`) in parallel.
+
+    The parsed chunks are retrieved from/stored in the passed blob cache.
+
+    Returns None, if the change needs to be analyzed as a whole, e.g. because
+    the modules can't be split or one of the chunks can't be parsed.
+    """
+    chunks = split_modules(contents_before, contents_after, chunk_count=chunk_count)
+    if not chunks:
+        return chunks
+    futures = [
+        executor.submit(_check_chunk, chunk_before, chunk_after, blob_cache)
+        for chunk_before, chunk_after in chunks
+    ]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            if not future.result():
+                return False
+    except (cst.ParserSyntaxError, RuntimeError, RecursionError):
+        return None
+    finally:
+        for future in futures:
+            future.cancel()
+    return True
+
+
+class ExtractorCache:
+    """
+    Cache of `DocstringExtractor` objects of the modules, keyed by blob SHA.
+
+    The extractors are kept in the per-run memo, shared by all hooks, and stored
+    pickled in the on-disk blob cache which allows the analysis of an already seen
+    blob to skip parsing completely.
+    """
+
+    #: Version of the format of the cached data.
+    #: This needs to be bumped when `DocstringExtractor`'s state changes.
+    FORMAT_VERSION = 2
+    NAMESPACE = "python"
+
+    def __init__(
+        self,
+        blob_cache: BlobCache | None,
+        memo: dict[str, DocstringExtractor] | None = None,
+    ) -> None:
+        self.blob_cache = blob_cache
+        self.memo = {} if memo is None else memo
+
+    @classmethod
+    def get_version(cls) -> str:
+        return (
+            f"{cls.FORMAT_VERSION}"
+            f"-libcst{importlib.metadata.version('libcst')}"
+            f"-py{sys.version_info[0]}.{sys.version_info[1]}"
+        )
+
+    @classmethod
+    def from_app(cls, app: App) -> Self:
+        return cls(
+            app.get_blob_cache(cls.NAMESPACE, cls.get_version()),
+            app.get_memo(cls.NAMESPACE),
+        )
+
+    def get_extractor(self, contents: str, sha: str | None) -> DocstringExtractor:
+        if sha is None:
+            return DocstringExtractor.from_contents(contents)
+        try:
+            return self.memo[sha]
+        except KeyError:
+            pass
+        extractor = self.memo[sha] = self._get_extractor(contents, sha)
+        return extractor
+
+    def _get_extractor(self, contents: str, sha: str) -> DocstringExtractor:
+        if self.blob_cache is None:
+            return DocstringExtractor.from_contents(contents)
+
+        data = self.blob_cache.get(sha)
+        if data is not None:
             try:
-                analyzer = PythonAnalyzer(
-                    file_info.contents_before, file_info.contents_after
-                )
-            except cst.ParserSyntaxError as exc:
-                hook_output.fail(file_info.filename, str(exc))
+                extractor = pickle.loads(data)
+            except Exception:
+                pass
+            else:
+                if isinstance(extractor, DocstringExtractor):
+                    return extractor
+
+        extractor = DocstringExtractor.from_contents(contents)
+        try:
+            data = pickle.dumps(extractor, protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # deeply nested trees can't be pickled, they'll just not be cached
+            pass
+        else:
+            self.blob_cache.set(sha, data)
+        return extractor
+
+
+def is_docstring_only_change(
+    contents_before: str,
+    contents_after: str,
+    *,
+    cache: ExtractorCache | None = None,
+    sha_before: str | None = None,
+    sha_after: str | None = None,
+    executor: concurrent.futures.Executor | None = None,
+    split_threshold: int = DEFAULT_SPLIT_THRESHOLD,
+    stats: dict[str, Any] | None = None,
+) -> bool:
+    """
+    Check whether the passed module contents differ only in docstrings.
+
+    If the cache is passed, the parsed modules are retrieved from/stored in it
+    using the passed blob SHAs.
+
+    If the executor is passed, modules larger than `split_threshold` are split
+    into chunks that are analyzed in parallel using the executor.
+
+    If the stats dictionary is passed, the engine that decided the result
+    (and the statistics of `PythonAnalyzer`, if it was used) are stored in it.
+
+    Raises `libcst.ParserSyntaxError`, if either of the contents can't be parsed.
+    """
+    if (sha_before is not None and sha_before == sha_after) or (
+        contents_before == contents_after
+    ):
+        if stats is not None:
+            stats["engine"] = "identical"
+        return True
+    engine = "tokens"
+    analyzer = None
+    is_docstring_only = classify_by_tokens(contents_before, contents_after)
+    if (
+        is_docstring_only is None
+        and executor is not None
+        and max(len(contents_before), len(contents_after)) > split_threshold
+    ):
+        engine = "chunks"
+        is_docstring_only = is_docstring_only_change_by_chunks(
+            contents_before,
+            contents_after,
+            executor=executor,
+            chunk_count=(os.cpu_count() or 1) * CHUNKS_PER_CPU,
+            blob_cache=None if cache is None else cache.blob_cache,
+        )
+    if is_docstring_only is None:
+        engine = "full"
+        # TODO: run AST check (on a tree with stripped docstrings)
+        # for additional safety
+        if cache is None:
+            analyzer = PythonAnalyzer(contents_before, contents_after)
+        else:
+            analyzer = PythonAnalyzer.from_extractors(
+                cache.get_extractor(contents_before, sha_before),
+                cache.get_extractor(contents_after, sha_after),
+            )
+        is_docstring_only = analyzer.is_docstring_only()
+    if stats is not None:
+        stats["engine"] = engine
+        if analyzer is not None:
+            stats.update(analyzer.get_stats())
+    return is_docstring_only
+
+
+def decode_source(source: bytes) -> str:
+    """
+    Decode the module's source using its declared (PEP 263) encoding.
+
+    Raises `SyntaxError`, if the declared encoding is invalid,
+    and `UnicodeDecodeError`, if the source can't be decoded with it.
+    """
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+    return source.decode(encoding)
+
+
+def format_stats(stats: dict[str, Any]) -> str:
+    """Format the statistics of the check (see `check_file()`) for humans."""
+    text = f"stats: {stats.get('engine')} engine, {stats['duration'] * 1000:.1f} ms"
+    if "comparisons" in stats:
+        text += (
+            f", {stats['nodes_before']}/{stats['nodes_after']} nodes"
+            f" ({stats['visited_before']}/{stats['visited_after']} visited,"
+            f" {stats['skipped_before']}/{stats['skipped_after']} skipped),"
+            f" {stats['comparisons']} comparisons"
+            f" ({stats['skipped_comparisons']} skipped),"
+            f" {stats['docstring_targets']} docstring targets"
+            f" ({stats['docstring_additions']} additions,"
+            f" {stats['docstring_removals']} removals)"
+        )
+    if divergence := stats.get("first_divergence"):
+        sides = []
+        for side, node_info in divergence.items():
+            if node_info is None:
+                sides.append(f"end of module ({side})")
             else:
-                # TODO: run AST check (on a tree with stripped docstrings)
-                # for additional safety
-                if analyzer.is_docstring_only():
-                    hook_output.success(
-                        file_info.filename, "contains only docstring changes."
-                    )
+                sides.append(
+                    f"{node_info['type']} at {node_info['line']}:{node_info['column']}"
+                    f" ({side})"
+                )
+        text += f"; first divergence: {' vs '.join(sides)}"
+    return text
+
+
+def check_file(
+    source_before: bytes,
+    source_after: bytes,
+    *,
+    cache: ExtractorCache | None = None,
+    sha_before: str | None = None,
+    sha_after: str | None = None,
+    executor: concurrent.futures.Executor | None = None,
+    split_threshold: int = DEFAULT_SPLIT_THRESHOLD,
+    full_analysis_max_size: int | None = None,
+    stats: dict[str, Any] | None = None,
+) -> tuple[MessageType, str]:
+    """
+    Check the file's raw contents, returning the message type and text to report.
+
+    The contents are only decoded, if they're not identical. Files larger than
+    `full_analysis_max_size` (in bytes) are only compared at the token level
+    and treated as non-docstring changes, if that is not enough to decide.
+
+    If the stats dictionary is passed, the statistics of the check are stored in it
+    (see `is_docstring_only_change()`).
+    """
+    if source_before == source_after:
+        if stats is not None:
+            stats["engine"] = "identical"
+        return "success", "contains only docstring changes."
+    try:
+        contents_before = decode_source(source_before)
+        contents_after = decode_source(source_after)
+    except (SyntaxError, UnicodeDecodeError) as exc:
+        return "fail", f"can't be decoded: {exc}"
+    if (
+        full_analysis_max_size is not None
+        and max(len(source_before), len(source_after)) > full_analysis_max_size
+    ):
+        if stats is not None:
+            stats["engine"] = "tokens"
+        is_docstring_only = classify_by_tokens(contents_before, contents_after)
+        if is_docstring_only is None:
+            return "fail", "is too large to be fully analyzed."
+        if is_docstring_only:
+            return "success", "contains only docstring changes."
+        return "fail", "contains non-docstring changes."
+    try:
+        is_docstring_only = is_docstring_only_change(
+            contents_before,
+            contents_after,
+            cache=cache,
+            sha_before=sha_before,
+            sha_after=sha_after,
+            executor=executor,
+            split_threshold=split_threshold,
+            stats=stats,
+        )
+    except cst.ParserSyntaxError as exc:
+        return "fail", str(exc)
+    if is_docstring_only:
+        return "success", "contains only docstring changes."
+    return "fail", "contains non-docstring changes."
+
+
+def _check_file_in_worker(
+    source_before: bytes,
+    source_after: bytes,
+    sha_before: str | None,
+    sha_after: str | None,
+    blob_cache: BlobCache | None,
+    full_analysis_max_size: int | None,
+    collect_stats: bool,
+) -> tuple[MessageType, str, dict[str, Any] | None]:
+    stats: dict[str, Any] | None = {} if collect_stats else None
+    msg_type, text = check_file(
+        source_before,
+        source_after,
+        cache=ExtractorCache(blob_cache),
+        sha_before=sha_before,
+        sha_after=sha_after,
+        full_analysis_max_size=full_analysis_max_size,
+        stats=stats,
+    )
+    return msg_type, text, stats
+
+
+class PythonHook(Hook):
+    def run(self, app: App, file_data: list[FileInfo]) -> HookOutputDict:
+        hook_output = HookOutput()
+        cache = ExtractorCache.from_app(app)
+        hook_options = app.hook_options.get(self.name, {})
+        split_threshold = int(
+            hook_options.get("split_threshold", DEFAULT_SPLIT_THRESHOLD)
+        )
+        full_analysis_max_size = (
+            int(hook_options["full_analysis_max_size"])
+            if hook_options.get("full_analysis_max_size")
+            else None
+        )
+        collect_stats = bool(int(hook_options.get("stats", 0)))
+        # the worker processes are only started once the first module is split
+        executor = concurrent.futures.ProcessPoolExecutor(mp_context=get_mp_context())
+        with ProcessWatchdog() as watchdog, executor:
+            for file_info in file_data:
+                filename = file_info.filename
+                if file_info.blob_before is None:
+                    hook_output.fail(filename, "only exists on the head branch.")
+                    continue
+                if file_info.blob_after is None:
+                    hook_output.fail(filename, "only exists on the base branch.")
+                    continue
+
+                # files are only analyzed in a separate (killable) process
+                # when there's a time limit, such files are never split
+                timeout = app.get_file_timeout(self)
+                stats: dict[str, Any] | None = {} if collect_stats else None
+                start = time.perf_counter()
+                try:
+                    if timeout is None:
+                        msg_type, text = check_file(
+                            file_info.blob_before,
+                            file_info.blob_after,
+                            cache=cache,
+                            sha_before=file_info.sha_before,
+                            sha_after=file_info.sha_after,
+                            executor=executor,
+                            split_threshold=split_threshold,
+                            full_analysis_max_size=full_analysis_max_size,
+                            stats=stats,
+                        )
+                    else:
+                        msg_type, text, stats = watchdog.call(
+                            _check_file_in_worker,
+                            file_info.blob_before,
+                            file_info.blob_after,
+                            file_info.sha_before,
+                            file_info.sha_after,
+                            cache.blob_cache,
+                            full_analysis_max_size,
+                            collect_stats,
+                            timeout=timeout,
+                        )
+                except TimeoutError:
+                    if timeout:
+                        hook_output.fail(
+                            filename, f"timed out after {timeout:g} seconds."
+                        )
+                    else:
+                        hook_output.fail(filename, TIME_BUDGET_EXHAUSTED_MESSAGE)
+                    continue
+                if msg_type == "success":
+                    hook_output.success(filename, text)
                 else:
-                    hook_output.fail(
-                        file_info.filename, "contains non-docstring changes."
-                    )
+                    hook_output.fail(filename, text)
+                if stats is not None:
+                    stats["duration"] = time.perf_counter() - start
+                    hook_output.add_stats(filename, stats)
+                    hook_output.info(filename, format_stats(stats))
 
         return hook_output.to_json()
 
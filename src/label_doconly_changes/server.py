@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Any
+
+from .app import DEFAULT_API_URL, App, PullRequestInfo, parse_options
+
+log = logging.getLogger(__name__)
+
+HANDLED_ACTIONS = frozenset(
+    ("opened", "synchronize", "reopened", "edited", "labeled", "unlabeled")
+)
+DEFAULT_GIT_URL = "https://github.com"
+_LOG_LEVELS = {
+    "fail": logging.INFO,
+    "success": logging.DEBUG,
+    "error": logging.ERROR,
+    "info": logging.DEBUG,
+}
+_REPO_FULL_NAME_RE = re.compile(r"[\w.-]+/[\w.-]+")
+
+
+def validate_repo_full_name(repo_full_name: Any) -> str:
+    """
+    Validate the repository's full name (`<OWNER>/<REPO>`) taken from a payload.
+
+    The name is used in paths and URLs so anything else is rejected with `ValueError`.
+    """
+    if not isinstance(repo_full_name, str) or not _REPO_FULL_NAME_RE.fullmatch(
+        repo_full_name
+    ):
+        raise ValueError(f"Invalid repository name: {repo_full_name!r}")
+    if any(part in (".", "..") for part in repo_full_name.split("/")):
+        raise ValueError(f"Invalid repository name: {repo_full_name!r}")
+    return repo_full_name
+
+
+class WebhookServer:
+    """
+    Long-running server that labels PRs in response to `pull_request` webhooks.
+
+    Bare mirrors of the repositories are kept in `mirror_dir` and only the refs
+    needed for the PR are fetched for each event. The events are processed
+    by a pool of workers with the events of a single repository processed serially:
+    they are queued per repository and a worker processes one event at a time
+    so that a burst of events for one repository doesn't block the other ones.
+    Hooks are imported once and the on-disk parse cache (`LDC_CACHE_DIR`,
+    by default a directory inside of `mirror_dir`) is shared by all events.
+
+    The repositories are always fetched from `git_url`, nothing from the payload
+    is trusted before its signature is verified with `webhook_secret`.
+    """
+
+    def __init__(
+        self,
+        *,
+        mirror_dir: str,
+        token: str,
+        webhook_secret: str,
+        api_url: str = DEFAULT_API_URL,
+        git_url: str = DEFAULT_GIT_URL,
+        workers: int = 4,
+        options: dict[str, str] | None = None,
+        hook_options: dict[str, dict[str, str]] | None = None,
+        host: str = "",
+        port: int = 8080,
+    ) -> None:
+        if not webhook_secret:
+            raise ValueError("The webhook secret is required.")
+        self.mirror_dir = os.path.abspath(mirror_dir)
+        self.token = token
+        self.webhook_secret = webhook_secret
+        self.api_url = api_url.rstrip("/")
+        self.git_url = git_url.rstrip("/")
+        self.options = {
+            "cache_dir": os.path.join(self.mirror_dir, ".cache"),
+            **(options or {}),
+        }
+        self.hook_options = hook_options or {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.futures: set[concurrent.futures.Future[None]] = set()
+        self._futures_lock = threading.Lock()
+        #: Pending events of each repository, the first one is being processed.
+        self._repo_queues: dict[str, collections.deque[dict[str, Any]]] = {}
+        self._repo_queues_lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def server_address(self) -> tuple[str, int]:
+        host, port = self.httpd.server_address[:2]
+        return str(host), int(port)
+
+    def _make_handler(self) -> type[http.server.BaseHTTPRequestHandler]:
+        server = self
+
+        class WebhookHandler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                signature = self.headers.get("X-Hub-Signature-256", "")
+                if not server.verify_signature(body, signature):
+                    self.send_error(401, "Invalid signature.")
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_error(400, "Invalid JSON payload.")
+                    return
+                event_name = self.headers.get("X-GitHub-Event", "")
+                accepted = server.handle_event(event_name, payload)
+                self.send_response(202 if accepted else 204)
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                log.debug(format, *args)
+
+        return WebhookHandler
+
+    def verify_signature(self, body: bytes, signature: str) -> bool:
+        if not self.webhook_secret:
+            return False
+        digest = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256)
+        return hmac.compare_digest(f"sha256={digest.hexdigest()}", signature)
+
+    def handle_event(self, event_name: str, payload: dict[str, Any]) -> bool:
+        """
+        Queue processing of the event, if it's a handled `pull_request` event.
+
+        Returns whether the event was queued.
+        """
+        if event_name != "pull_request":
+            return False
+        action = payload.get("action")
+        if action not in HANDLED_ACTIONS:
+            return False
+        if action == "edited" and "base" not in payload.get("changes", {}):
+            return False
+        try:
+            repo_full_name = validate_repo_full_name(
+                payload.get("repository", {}).get("full_name")
+            )
+        except ValueError as exc:
+            log.warning("Ignoring the event: %s", exc)
+            return False
+        with self._repo_queues_lock:
+            queue = self._repo_queues.get(repo_full_name)
+            if queue is not None:
+                # processed once the earlier events of the repository are done
+                queue.append(payload)
+                return True
+            self._repo_queues[repo_full_name] = collections.deque((payload,))
+        self._submit(repo_full_name)
+        return True
+
+    def _submit(self, repo_full_name: str) -> None:
+        future = self.executor.submit(self._process_next_event, repo_full_name)
+        with self._futures_lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard_future)
+
+    def _discard_future(self, future: concurrent.futures.Future[None]) -> None:
+        with self._futures_lock:
+            self.futures.discard(future)
+
+    def _process_next_event(self, repo_full_name: str) -> None:
+        with self._repo_queues_lock:
+            payload = self._repo_queues[repo_full_name][0]
+        try:
+            self.process_pull_request(payload)
+        except Exception:
+            log.exception("Failed to process %s#%s", repo_full_name, payload["number"])
+
+        with self._repo_queues_lock:
+            queue = self._repo_queues[repo_full_name]
+            queue.popleft()
+            if not queue:
+                del self._repo_queues[repo_full_name]
+                return
+        # the next event is submitted instead of processed right away
+        # so that the events of other repositories queued in the meantime get a turn
+        try:
+            self._submit(repo_full_name)
+        except RuntimeError:
+            log.warning(
+                "Dropping %s pending events of %s as the server is shutting down.",
+                len(queue),
+                repo_full_name,
+            )
+
+    def _git(
+        self, *args: str, cwd: str | None = None, env: dict[str, str] | None = None
+    ) -> str:
+        return subprocess.check_output(
+            ("git", *args), cwd=cwd, env=env, encoding="utf-8", stderr=subprocess.PIPE
+        ).strip()
+
+    def _get_auth_env(self) -> dict[str, str]:
+        """
+        Get the environment of git commands authenticating with the token.
+
+        The token is passed through the `GIT_CONFIG_*` environment variables
+        as the command line arguments can be read by any local user.
+        """
+        env = dict(os.environ)
+        idx = int(env.get("GIT_CONFIG_COUNT") or 0)
+        credentials = base64.b64encode(f"x-access-token:{self.token}".encode())
+        env[f"GIT_CONFIG_KEY_{idx}"] = "http.extraHeader"
+        env[f"GIT_CONFIG_VALUE_{idx}"] = f"Authorization: Basic {credentials.decode()}"
+        env["GIT_CONFIG_COUNT"] = str(idx + 1)
+        return env
+
+    def update_mirror(self, payload: dict[str, Any]) -> str:
+        """Fetch the refs needed for the PR to the repository's mirror."""
+        repo_full_name = validate_repo_full_name(payload["repository"]["full_name"])
+        pr_data = payload["pull_request"]
+        mirror_path = os.path.join(self.mirror_dir, f"{repo_full_name}.git")
+        if not os.path.isdir(mirror_path):
+            os.makedirs(mirror_path)
+            self._git("init", "--bare", "-q", cwd=mirror_path)
+
+        # the clone URL from the payload is never used, the token is only sent
+        # to the configured host
+        clone_url = f"{self.git_url}/{repo_full_name}.git"
+        env = None
+        if clone_url.startswith(("http://", "https://")):
+            env = self._get_auth_env()
+        base_branch = pr_data["base"]["ref"]
+        self._git(
+            "fetch",
+            "-q",
+            "--no-tags",
+            clone_url,
+            f"+refs/heads/{base_branch}:refs/heads/{base_branch}",
+            f"+refs/pull/{payload['number']}/head:refs/pull/{payload['number']}/head",
+            cwd=mirror_path,
+            env=env,
+        )
+        return mirror_path
+
+    def process_pull_request(self, payload: dict[str, Any]) -> int:
+        pr_data = payload["pull_request"]
+        mirror_path = self.update_mirror(payload)
+        head_sha = pr_data["head"]["sha"]
+        base_sha = self._git(
+            "merge-base", pr_data["base"]["sha"], head_sha, cwd=mirror_path
+        )
+        app = App(
+            base_ref=base_sha,
+            head_ref=head_sha,
+            repo_path=mirror_path,
+            options=self.options,
+            hook_options=self.hook_options,
+            pr_info=PullRequestInfo.from_event(
+                payload, token=self.token, api_url=self.api_url
+            ),
+            print_messages=False,
+        )
+        exit_code = app.run()
+        self._log_messages(
+            app, f"{payload['repository']['full_name']}#{payload['number']}"
+        )
+        return exit_code
+
+    def _log_messages(self, app: App, pr_name: str) -> None:
+        for message in app.messages:
+            log.log(_LOG_LEVELS[message["type"]], "%s: %s", pr_name, message["text"])
+        for ruleset in app.rulesets:
+            prefix = pr_name
+            if len(app.rulesets) > 1:
+                prefix = f"{pr_name} [{ruleset.name}]"
+            for filename, file_result in ruleset.file_results.items():
+                for message in file_result.messages:
+                    log.log(
+                        _LOG_LEVELS[message["type"]],
+                        "%s: %s %s",
+                        prefix,
+                        filename,
+                        message["text"],
+                    )
+        log.info(
+            "Processed %s (errored: %s, doc-only: %s)",
+            pr_name,
+            app.errored,
+            app.is_doc_only,
+        )
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def wait_idle(self, timeout: float | None = None) -> None:
+        """Wait for all queued events to be processed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # processing an event can submit the next event of the repository
+            with self._futures_lock:
+                futures = set(self.futures)
+            if not futures:
+                return
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            concurrent.futures.wait(futures, timeout=remaining)
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.shutdown(wait=True)
+        if self._thread is not None:
+            self._thread.join()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--mirror-dir",
+        required=True,
+        help="Directory in which the bare mirrors of the repositories are kept.",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--api-url",
+        default=os.environ.get("GITHUB_API_URL", DEFAULT_API_URL),
+        help="Base URL of the GitHub API, useful for GitHub Enterprise Server.",
+    )
+    parser.add_argument(
+        "--git-url",
+        default=os.environ.get("GITHUB_SERVER_URL", DEFAULT_GIT_URL),
+        help="Base URL that the repositories are fetched from.",
+    )
+
+
+def main(args: argparse.Namespace) -> int:
+    logging.basicConfig(level=logging.INFO)
+    webhook_secret = os.environ.get("GITHUB_WEBHOOK_SECRET")
+    if not webhook_secret:
+        log.error("GITHUB_WEBHOOK_SECRET needs to be set.")
+        return 2
+    options, hook_options = parse_options(os.environ)
+    server = WebhookServer(
+        mirror_dir=args.mirror_dir,
+        token=os.environ["GITHUB_TOKEN"],
+        webhook_secret=webhook_secret,
+        api_url=args.api_url,
+        git_url=args.git_url,
+        workers=args.workers,
+        options=options,
+        hook_options=hook_options,
+        host=args.host,
+        port=args.port,
+    )
+    log.info("Listening on %s:%s", *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
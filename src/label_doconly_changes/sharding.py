@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+
+from .app import AnalysisResult, App, RuleSetResult
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """
+    Parse the shard specification in the `<INDEX>/<COUNT>` format (e.g. `2/4`).
+
+    The index is 1-based.
+    """
+    index, sep, count = value.partition("/")
+    try:
+        if not sep:
+            raise ValueError
+        shard_index, shard_count = int(index), int(count)
+    except ValueError:
+        raise ValueError(
+            f"Invalid shard {value!r}, expected <INDEX>/<COUNT> (e.g. 2/4)."
+        ) from None
+    if not 1 <= shard_index <= shard_count:
+        raise ValueError(
+            f"Invalid shard {value!r}, the index needs to be between 1 and the count."
+        )
+    return shard_index, shard_count
+
+
+def partition_files(sizes: dict[str, int], shard_count: int) -> list[list[str]]:
+    """
+    Partition the files into shards of similar total size.
+
+    This uses the longest-processing-time-first rule: the files are assigned
+    from the largest one to the shard with the smallest total size so far.
+    Ties are broken by the filename and shard index so the partition only depends
+    on the passed sizes. Files in each shard keep the order of the passed mapping.
+    """
+    order = {filename: idx for idx, filename in enumerate(sizes)}
+    shards: list[list[str]] = [[] for _ in range(shard_count)]
+    heap = [(0, idx) for idx in range(shard_count)]
+    for filename in sorted(sizes, key=lambda filename: (-sizes[filename], filename)):
+        total, idx = heapq.heappop(heap)
+        shards[idx].append(filename)
+        heapq.heappush(heap, (total + sizes[filename], idx))
+    for shard in shards:
+        shard.sort(key=order.__getitem__)
+    return shards
+
+
+def get_shard_files(app: App, files: list[str], shard: str) -> list[str]:
+    """Get the files from the passed list that belong to the app's shard."""
+    shard_index, shard_count = parse_shard(shard)
+    sizes = {
+        filename: max((blob.size for blob in blobs if blob is not None), default=0)
+        for filename, blobs in app.get_file_metadata(files).items()
+    }
+    return partition_files(sizes, shard_count)[shard_index - 1]
+
+
+def merge_results(results: list[AnalysisResult]) -> AnalysisResult:
+    """
+    Merge the results of all shards of a run into the result of the whole run.
+
+    Raises `ValueError`, if the results are not the results of all shards
+    of a single run.
+    """
+    if not results:
+        raise ValueError("There are no results to merge.")
+    fingerprints = {result.fingerprint for result in results}
+    if len(fingerprints) != 1:
+        raise ValueError("The results are from runs with different fingerprints.")
+    shards = sorted(parse_shard(result.shard or "1/1") for result in results)
+    shard_count = shards[0][1]
+    if shards != [(idx, shard_count) for idx in range(1, shard_count + 1)]:
+        raise ValueError("The results don't contain each shard of the run once.")
+
+    files = {
+        filename: file_result
+        for result in results
+        for filename, file_result in result.files.items()
+    }
+    rulesets = {}
+    for name, ruleset_result in results[0].rulesets.items():
+        ruleset_files = {
+            filename: file_result
+            for result in results
+            for filename, file_result in result.rulesets[name].files.items()
+        }
+        rulesets[name] = RuleSetResult(
+            is_doc_only=all(result.rulesets[name].is_doc_only for result in results),
+            labels=ruleset_result.labels,
+            files=dict(sorted(ruleset_files.items())),
+        )
+    # messages that are not tied to a file (e.g. about identical branches)
+    # are reported by each of the shards
+    messages = []
+    for result in results:
+        for message in result.messages:
+            if message not in messages:
+                messages.append(message)
+    hook_durations: dict[str, float] = {}
+    for result in results:
+        for hook_name, duration in result.hook_durations.items():
+            hook_durations[hook_name] = hook_durations.get(hook_name, 0.0) + duration
+    return AnalysisResult(
+        is_doc_only=all(result.is_doc_only for result in results),
+        errored=any(result.errored for result in results),
+        files=dict(sorted(files.items())),
+        rulesets=rulesets,
+        messages=messages,
+        hook_durations=hook_durations,
+        duration=max(result.duration for result in results),
+        fingerprint=results[0].fingerprint,
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "result_files",
+        nargs="+",
+        metavar="RESULT_FILE",
+        help="Result files (LDC_RESULT_FILE) written by each shard of the run.",
+    )
+
+
+def main(args: argparse.Namespace) -> int:
+    results = []
+    for path in args.result_files:
+        with open(path, encoding="utf-8") as fp:
+            results.append(AnalysisResult.from_json(json.load(fp)))
+    result = merge_results(results)
+
+    app = App.from_environ()
+    # the merge is never sharded itself
+    app.options.pop("shard", None)
+    app.report_result(result)
+    app.store_result(result)
+    if result.files and app.pr_info is not None:
+        app._update_labels()
+        result.errored = app.errored
+    app.write_outputs(result)
+    return app.exit_code
@@ -0,0 +1,316 @@
+import concurrent.futures
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Iterable
+
+import pytest
+
+from label_doconly_changes import app as app_module
+from label_doconly_changes.app import App, analyze
+from label_doconly_changes.hooks import python
+from tests.utils import GitRepo, record_hook_files
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> GitRepo:
+    monkeypatch.chdir(tmp_path)
+    return GitRepo(tmp_path)
+
+
+def test_deduplicate_identical_blobs(
+    repo: GitRepo, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    before = 'def f():\n    """doc"""\n    return 1\n'
+    after = "def f():\n    return 1\n"
+    base_ref = repo.commit({"a.py": before, "vendor/a.py": before, "b.py": before})
+    repo.commit({"a.py": after, "vendor/a.py": after, "b.py": "x = 1\n"})
+
+    seen_files = record_hook_files(monkeypatch, python.PythonHook)
+    app = App(base_ref=base_ref)
+    assert app.run() == 2
+    assert sorted(seen_files) == ["a.py", "b.py"]
+    stdout = capsys.readouterr().out.splitlines()
+    assert "a.py contains only docstring changes." in stdout
+    assert "vendor/a.py contains only docstring changes." in stdout
+
+
+def test_parse_memo_is_shared(repo: GitRepo) -> None:
+    before = 'def f():\n    """doc"""\n    return 1\n'
+    base_ref = repo.commit({"a.py": before})
+    repo.commit({"a.py": "def f():\n    return 1\n"})
+
+    app = App(base_ref=base_ref)
+    app.run()
+    memo = app.get_memo(python.ExtractorCache.NAMESPACE)
+    assert len(memo) == 2
+
+
+def test_time_budget_exhausted(repo: GitRepo, capsys: pytest.CaptureFixture) -> None:
+    base_ref = repo.commit({"a.py": "x = 1\n", "README.md": "a"})
+    repo.commit({"a.py": "x = 1\n# comment\n", "README.md": "b"})
+
+    app = App(base_ref=base_ref, options={"time_budget": "0"})
+    assert app.run() == 2
+    stderr = capsys.readouterr().err.splitlines()
+    assert "!!! README.md timed out (time budget exhausted)." in stderr
+    assert "!!! a.py timed out (time budget exhausted)." in stderr
+
+
+def test_file_timeout(repo: GitRepo, capsys: pytest.CaptureFixture) -> None:
+    base_ref = repo.commit({"a.py": 'def f():\n    """doc"""\n'})
+    repo.commit({"a.py": "def f():\n    pass\n"})
+
+    app = App(base_ref=base_ref, hook_options={"python": {"file_timeout": "60"}})
+    assert app.run() == 2
+    assert "!!! a.py contains non-docstring changes." in capsys.readouterr().err
+
+
+def test_notebook_file_timeout(repo: GitRepo, capsys: pytest.CaptureFixture) -> None:
+    def notebook(source: str) -> str:
+        cell = {"cell_type": "code", "metadata": {}, "outputs": [], "source": source}
+        return json.dumps({"cells": [cell], "metadata": {}, "nbformat": 4})
+
+    base_ref = repo.commit({"a.ipynb": notebook('def f():\n    """doc"""\n')})
+    repo.commit({"a.ipynb": notebook("def f():\n    pass\n")})
+    options = {"enabled_hooks": "jupyter"}
+
+    app = App(
+        base_ref=base_ref,
+        options=options,
+        hook_options={"jupyter": {"file_timeout": "60"}},
+    )
+    assert app.run() == 2
+    stderr = capsys.readouterr().err.splitlines()
+    assert "!!! a.ipynb contains non-docstring changes in a code cell." in stderr
+
+    # the worker process can't even start in time
+    app = App(
+        base_ref=base_ref,
+        options=options,
+        hook_options={"jupyter": {"file_timeout": "0.000001"}},
+    )
+    assert app.run() == 2
+    stderr = capsys.readouterr().err.splitlines()
+    assert "!!! a.ipynb timed out after 1e-06 seconds." in stderr
+
+
+def test_comments_file_timeout(repo: GitRepo, capsys: pytest.CaptureFixture) -> None:
+    base_ref = repo.commit({"a.c": "int x = 1;\n"})
+    repo.commit({"a.c": "int x = 1; // comment\n"})
+    options = {"enabled_hooks": "comments.c"}
+
+    app = App(
+        base_ref=base_ref,
+        options=options,
+        hook_options={"comments.c": {"file_timeout": "60"}},
+    )
+    assert app.run() == 0
+    assert "a.c contains only comment changes." in capsys.readouterr().out
+
+    # the worker process can't even start in time
+    app = App(
+        base_ref=base_ref,
+        options=options,
+        hook_options={"comments.c": {"file_timeout": "0.000001"}},
+    )
+    assert app.run() == 2
+    stderr = capsys.readouterr().err.splitlines()
+    assert "!!! a.c timed out after 1e-06 seconds." in stderr
+
+
+def test_analyze(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    repo = GitRepo(tmp_path)
+    base_ref = repo.commit({"a.py": 'def f():\n    """doc"""\n', "b.txt": "a"})
+    repo.commit({"a.py": 'def f():\n    """new doc"""\n', "b.txt": "b"})
+
+    result = analyze(str(tmp_path), base_ref)
+    assert capsys.readouterr() == ("", "")
+    assert not result.is_doc_only
+    assert not result.errored
+    assert result.files["a.py"].hook_name == "python"
+    assert result.files["a.py"].is_doc_only
+    assert result.files["a.py"].messages == [
+        {
+            "type": "success",
+            "filename": "a.py",
+            "text": "contains only docstring changes.",
+        }
+    ]
+    assert result.files["a.py"].duration > 0
+    assert result.files["b.txt"].hook_name is None
+    assert not result.files["b.txt"].is_doc_only
+    assert set(result.hook_durations) == {"unconditional", "python"}
+
+
+def test_analyze_concurrently(tmp_path: Path) -> None:
+    repo = GitRepo(tmp_path)
+    base_ref = repo.commit({"a.txt": "a"})
+    repo.commit({"a.txt": "b"})
+
+    def run(allowed_files: str) -> bool:
+        hook_options = {"unconditional": {"allowed_files": allowed_files}}
+        result = analyze(str(tmp_path), base_ref, hook_options=hook_options)
+        return result.is_doc_only
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(run, ["*.txt", "*.md"] * 8))
+    assert results == [True, False] * 8
+
+
+def test_rulesets(
+    repo: GitRepo, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    base_ref = repo.commit(
+        {"a.py": 'def f():\n    """doc"""\n', "tests/test_a.py": "x = 1\n"}
+    )
+    repo.commit({"a.py": 'def f():\n    """changed"""\n', "tests/test_a.py": "x = 2\n"})
+
+    seen_files = record_hook_files(monkeypatch, python.PythonHook)
+    app = App(
+        base_ref=base_ref,
+        options={
+            "rulesets": "docs,docs-or-tests",
+            "ruleset_docs__labels": "doc-only",
+            "ruleset_docs_or_tests__hook_unconditional__files": "tests/*",
+        },
+    )
+    result = app.analyze()
+    # each file is only analyzed once by the python hook
+    assert seen_files == ["a.py", "tests/test_a.py"]
+    assert not result.is_doc_only
+    assert not result.rulesets["docs"].is_doc_only
+    assert result.rulesets["docs"].labels == {"doc-only"}
+    assert result.rulesets["docs-or-tests"].is_doc_only
+    assert result.rulesets["docs-or-tests"].labels == {"docs-or-tests"}
+    files = result.rulesets["docs-or-tests"].files
+    assert files["tests/test_a.py"].hook_name == "unconditional"
+    assert files["a.py"].hook_name == "python"
+    assert result.files == result.rulesets["docs"].files
+
+    stdout = capsys.readouterr().out.splitlines()
+    assert stdout.count("a.py contains only docstring changes.") == 2
+    assert "--- Rule set 'docs-or-tests' ---" in stdout
+
+
+def test_outputs(repo: GitRepo, tmp_path: Path) -> None:
+    base_ref = repo.commit({"a.py": 'def f():\n    """doc"""\n', "b.txt": "a"})
+    repo.commit({"a.py": 'def f():\n    """new doc"""\n', "b.txt": "b"})
+    github_output = tmp_path / "github_output"
+    result_file = tmp_path / "result.json"
+
+    app = App(
+        base_ref=base_ref,
+        options={"result_file": str(result_file)},
+        github_output=str(github_output),
+    )
+    assert app.run() == 2
+    outputs = dict(
+        line.split("=", 1) for line in github_output.read_text().splitlines()
+    )
+    assert outputs["is-doc-only"] == "false"
+    assert outputs["errored"] == "false"
+    assert json.loads(outputs["hook-counts"]) == {"python": {"files": 1, "doc_only": 1}}
+    assert json.loads(outputs["rulesets"]) == {"default": False}
+    assert outputs["result-file"] == str(result_file)
+
+    result_data = json.loads(result_file.read_text())
+    assert result_data["fingerprint"] == outputs["fingerprint"]
+    assert result_data["files"]["a.py"]["is_doc_only"]
+    assert not result_data["files"]["b.txt"]["is_doc_only"]
+
+    # the fingerprint doesn't depend on the environment-specific options
+    result = analyze(str(tmp_path), base_ref, options={"cache_dir": str(tmp_path)})
+    assert result.fingerprint == outputs["fingerprint"]
+    result = analyze(str(tmp_path), base_ref, options={"labels": "other"})
+    assert result.fingerprint != outputs["fingerprint"]
+
+
+def test_max_size(
+    repo: GitRepo, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    large = 'def f():\n    """doc"""\n' + "x = 1\n" * 100
+    base_ref = repo.commit({"large.py": large, "small.py": 'def f():\n    """a"""\n'})
+    repo.commit(
+        {
+            "large.py": large.replace("doc", "new doc"),
+            "small.py": 'def f():\n    """b"""\n',
+        }
+    )
+
+    read_shas = []
+    original_read_blobs = app_module.read_blobs
+
+    def read_blobs(shas: Iterable[str], **kwargs: Any) -> dict[str, bytes]:
+        shas = list(shas)
+        read_shas.extend(shas)
+        return original_read_blobs(shas, **kwargs)
+
+    monkeypatch.setattr(app_module, "read_blobs", read_blobs)
+    app = App(base_ref=base_ref, hook_options={"python": {"max_size": "100"}})
+    assert app.run() == 2
+    assert len(read_shas) == 2
+    assert app.file_results["small.py"].is_doc_only
+    assert app.file_results["large.py"].messages[0]["text"] == (
+        "is too large (627 bytes, the limit is 100 bytes)."
+    )
+    assert "!!! large.py is too large" in capsys.readouterr().err
+
+
+def test_python_stats(repo: GitRepo, capsys: pytest.CaptureFixture) -> None:
+    base_ref = repo.commit({"a.py": 'def f():\n    """doc"""\n    x = 1\n'})
+    repo.commit({"a.py": "def f():\n    x  = 1\n"})
+
+    app = App(base_ref=base_ref, hook_options={"python": {"stats": "1"}})
+    assert app.run() == 2
+    stats = app.file_results["a.py"].stats
+    assert stats["engine"] == "full"
+    assert stats["first_divergence"]["after"]["line"] == 2
+    stdout = capsys.readouterr().out
+    assert "a.py stats: full engine" in stdout
+    assert "first divergence: SimpleWhitespace at 3:6 (before)" in stdout
+
+
+def test_stored_results_are_evicted(
+    repo: GitRepo, tmp_path_factory: pytest.TempPathFactory
+) -> None:
+    cache_dir = tmp_path_factory.mktemp("cache")
+    stale_entry = cache_dir / app_module.RESULT_CACHE_NAMESPACE / "0/ab/cdef"
+    stale_entry.parent.mkdir(parents=True)
+    stale_entry.write_bytes(b"stale")
+    # every entry is over the limit and gets evicted before the new one is stored
+    options = {"cache_dir": str(cache_dir), "cache_max_size": "1"}
+
+    def get_entries() -> list[Path]:
+        return sorted(
+            path
+            for path in (cache_dir / app_module.RESULT_CACHE_NAMESPACE).rglob("*")
+            if path.is_file()
+        )
+
+    base_ref = repo.commit({"README.md": "a"})
+    repo.commit({"README.md": "b"})
+    app = App(base_ref=base_ref, options=options)
+    assert app.run() == 0
+    assert not stale_entry.parent.parent.exists()
+    (first_entry,) = get_entries()
+
+    repo.commit({"README.md": "c"})
+    app = App(base_ref=base_ref, options=options)
+    assert app.run() == 0
+    (second_entry,) = get_entries()
+    assert second_entry != first_entry
+
+
+def test_main_imports_subcommands_lazily() -> None:
+    code = (
+        "import sys\n"
+        "import label_doconly_changes.__main__\n"
+        "print(sorted(\n"
+        "    name for name in ('bundle', 'server', 'sharding', 'cProfile')\n"
+        "    if name in sys.modules or f'label_doconly_changes.{name}' in sys.modules\n"
+        "))\n"
+    )
+    output = subprocess.check_output((sys.executable, "-c", code), encoding="utf-8")
+    assert output.strip() == "[]"
@@ -0,0 +1,78 @@
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from label_doconly_changes.base_hooks import (
+    ProcessWatchdog,
+    _run_with_timeout,
+    get_blob_metadata,
+    get_blob_sha,
+    read_blobs,
+)
+from tests.utils import GitRepo
+
+
+def test_process_watchdog() -> None:
+    with ProcessWatchdog() as watchdog:
+        assert watchdog.call(pow, 2, 3, timeout=None) == 8
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            watchdog.call(time.sleep, 30, timeout=0.5)
+        assert time.monotonic() - start < 10
+        # the killed worker gets replaced
+        assert watchdog.call(pow, 2, 3, timeout=10) == 8
+        with pytest.raises(TimeoutError):
+            watchdog.call(pow, 2, 3, timeout=0)
+
+
+def test_run_with_timeout_kills_children() -> None:
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        _run_with_timeout(("sh", "-c", "sleep 30 & sleep 30; wait"), timeout=0.5)
+    assert time.monotonic() - start < 10
+
+
+def test_run_with_timeout_error() -> None:
+    _run_with_timeout(("true",), timeout=10)
+    with pytest.raises(subprocess.CalledProcessError):
+        _run_with_timeout(("false",), timeout=None)
+
+
+def test_blob_metadata_and_read_blobs(tmp_path: Path) -> None:
+    repo = GitRepo(tmp_path)
+    contents = {"a.py": "x = 1\n", "b b.txt": "", "c.bin": "\n\0\n"}
+    ref = repo.commit(contents)
+
+    metadata = get_blob_metadata(
+        [f"{ref}:{name}" for name in (*contents, "missing.py")], repo_path=str(tmp_path)
+    )
+    assert metadata[-1] is None
+    assert [blob.size for blob in metadata if blob is not None] == [6, 0, 3]
+    blobs = read_blobs(
+        [blob.sha for blob in metadata if blob is not None], repo_path=str(tmp_path)
+    )
+    assert list(blobs.values()) == [b"x = 1\n", b"", b"\n\0\n"]
+    for sha, blob in blobs.items():
+        assert get_blob_sha(blob) == sha
+
+
+def test_read_many_blobs(tmp_path: Path) -> None:
+    repo = GitRepo(tmp_path)
+    # the input of the query is larger than the pipe's buffer
+    contents = {f"{idx}.txt": f"{idx}\n" * idx for idx in range(2000)}
+    ref = repo.commit(contents)
+
+    metadata = get_blob_metadata(
+        [f"{ref}:{name}" for name in contents], repo_path=str(tmp_path)
+    )
+    blobs = read_blobs(
+        [blob.sha for blob in metadata if blob is not None], repo_path=str(tmp_path)
+    )
+    assert list(blobs.values()) == [
+        text.encode() for text in dict.fromkeys(contents.values())
+    ]
+
+    with pytest.raises(ValueError):
+        read_blobs(["0" * 40], repo_path=str(tmp_path))
@@ -0,0 +1,113 @@
+import argparse
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from label_doconly_changes import bundle
+from label_doconly_changes.app import App
+from label_doconly_changes.base_hooks import get_blob_sha
+from tests.utils import GitRepo
+
+
+@pytest.fixture
+def bundle_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    monkeypatch.chdir(repo_path)
+    repo = GitRepo(repo_path)
+    base_ref = repo.commit(
+        {
+            "a.py": 'def f():\n    """doc"""\n',
+            "b.py": "x = 1\n",
+            "README.md": "a",
+            "setup.cfg": "a",
+        }
+    )
+    repo.commit(
+        {
+            "a.py": 'def f():\n    """new doc"""\n',
+            "b.py": None,
+            "README.md": "b",
+            "setup.cfg": "b",
+        }
+    )
+
+    path = tmp_path / "bundle.zip"
+    app = App(
+        base_ref=base_ref,
+        options={"record_bundle": str(path), "cache_dir": str(tmp_path / "cache")},
+    )
+    assert app.run() == 2
+    return path
+
+
+def test_record(bundle_path: Path) -> None:
+    recorded = bundle.Bundle.load(str(bundle_path))
+    assert sorted(recorded.files) == ["README.md", "a.py", "b.py", "setup.cfg"]
+    assert sorted(recorded.file_blobs) == ["README.md", "a.py", "b.py"]
+    assert recorded.file_blobs["b.py"][1] is None
+    assert "record_bundle" not in recorded.options
+    assert "cache_dir" not in recorded.options
+
+    with zipfile.ZipFile(bundle_path) as zf:
+        names = zf.namelist()
+    assert bundle.MANIFEST_NAME in names
+    # before and after blobs of a.py and README.md, before blob of b.py
+    assert len([name for name in names if name.startswith("blobs/")]) == 5
+
+
+def test_replay(
+    bundle_path: Path, tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    capsys.readouterr()
+    profile_path = tmp_path / "profile.out"
+    args = argparse.Namespace(
+        bundle=str(bundle_path),
+        sort="cumulative",
+        limit=10,
+        profile_output=str(profile_path),
+    )
+    assert bundle.main(args) == 2
+    captured = capsys.readouterr()
+    assert "a.py contains only docstring changes." in captured.out.splitlines()
+    assert "!!! b.py only exists on the base branch." in captured.err
+    assert "!!! setup.cfg is not documentation." in captured.err
+    assert "function calls" in captured.err
+    assert profile_path.exists()
+
+
+def test_replay_too_large(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    monkeypatch.chdir(repo_path)
+    repo = GitRepo(repo_path)
+    base_ref = repo.commit({"a.py": 'def f():\n    """doc"""\n', "b.py": "x = 1\n"})
+    repo.commit({"a.py": 'def f():\n    """new doc"""\n', "b.py": "x = 2\n" * 10})
+
+    path = tmp_path / "bundle.zip"
+    app = App(
+        base_ref=base_ref,
+        options={"record_bundle": str(path)},
+        hook_options={"python": {"max_size": "50"}},
+    )
+    assert app.run() == 2
+    expected = "!!! b.py is too large (60 bytes, the limit is 50 bytes)."
+    assert expected in capsys.readouterr().err.splitlines()
+
+    recorded = bundle.Bundle.load(str(path))
+    assert sorted(recorded.file_blobs) == ["a.py"]
+    assert recorded.skipped_files["b.py"][1] == (
+        get_blob_sha(b"x = 2\n" * 10),
+        60,
+    )
+
+    args = argparse.Namespace(
+        bundle=str(path), sort="cumulative", limit=10, profile_output=None
+    )
+    assert bundle.main(args) == 2
+    captured = capsys.readouterr()
+    assert "a.py contains only docstring changes." in captured.out.splitlines()
+    assert expected in captured.err.splitlines()
@@ -0,0 +1,36 @@
+import os
+from pathlib import Path
+
+from label_doconly_changes.cache import BlobCache
+
+
+def test_get_set(tmp_path: Path) -> None:
+    cache = BlobCache(str(tmp_path), namespace="test", version="1")
+    assert cache.get("abcdef") is None
+    cache.set("abcdef", b"data")
+    assert cache.get("abcdef") == b"data"
+    assert BlobCache(str(tmp_path), namespace="test", version="2").get("abcdef") is None
+
+
+def test_evict_stale_versions(tmp_path: Path) -> None:
+    BlobCache(str(tmp_path), namespace="test", version="1").set("abcdef", b"data")
+    BlobCache(str(tmp_path), namespace="other", version="1").set("abcdef", b"data")
+    cache = BlobCache(str(tmp_path), namespace="test", version="2")
+    cache.set("abcdef", b"new data")
+    cache.evict()
+    assert os.listdir(tmp_path / "test") == ["2"]
+    assert cache.get("abcdef") == b"new data"
+    assert BlobCache(str(tmp_path), namespace="other", version="1").get("abcdef")
+
+
+def test_evict_least_recently_used(tmp_path: Path) -> None:
+    cache = BlobCache(str(tmp_path), namespace="test", version="1", max_size=0)
+    for idx, sha in enumerate(("aa0000", "bb0000", "cc0000")):
+        cache.set(sha, os.urandom(100))
+        os.utime(cache._get_entry_path(sha), (idx, idx))
+    entry_size = os.path.getsize(cache._get_entry_path("aa0000"))
+    cache.max_size = entry_size * 2
+    cache.evict()
+    assert cache.get("aa0000") is None
+    assert cache.get("bb0000") is not None
+    assert cache.get("cc0000") is not None
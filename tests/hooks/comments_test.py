@@ -0,0 +1,157 @@
+import time
+
+import pytest
+
+from label_doconly_changes.app import App
+from label_doconly_changes.base_hooks import FileInfo
+from label_doconly_changes.hooks import comments
+
+
+@pytest.mark.parametrize(
+    "language,contents_before,contents_after",
+    (
+        (comments.C, "int x = 1;\n", "int x = 1; // comment\n"),
+        (comments.C, "int x = 1;\n", "/*\n * comment\n */\nint x = 1;\n"),
+        (comments.C, "int x = 1;\n", "int /* comment */ x = 1;\n"),
+        (comments.C, "#define A(x) x\n", "#define A(x) x // a \\\n comment\n"),
+        (comments.JS, "let x = 1;\n", "// comment\n\nlet x = 1;\n"),
+        (comments.JS, "let x = `a\n`;\n", "let x = `a\n`; /* comment */\n"),
+        (comments.JS, "x = /a/g.test(b);\n", "x = /a/g.test(b); // /c/\n"),
+        (comments.JS, "x = a / b;\n", "x = a / b; // c / d\n"),
+        (comments.JS, "x = f(a) / b;\n", "x = f(a) / b; /* c / d */\n"),
+        (comments.GO, "x := 1\n", "x := 1 // comment\n"),
+        (comments.GO, "x := `a`\n", "// comment\nx := `a`\n"),
+        (
+            comments.YAML,
+            "a: 1\nb:\n  c: 2\n",
+            "# comment\na: 1 # comment\nb:\n  c: 2\n",
+        ),
+        (comments.YAML, "a: b#c\n", "a: b#c # comment\n"),
+        (comments.TOML, 'a = "b"\n', '# comment\na = "b" # comment\n'),
+        (comments.TOML, 'a = """\nb\n"""\n', 'a = """\nb\n""" # comment\n'),
+    ),
+)
+def test_comment_only_true(
+    language: comments.LanguageSpec, contents_before: str, contents_after: str
+) -> None:
+    assert comments.strip_comments(
+        contents_before, language
+    ) == comments.strip_comments(contents_after, language)
+
+
+@pytest.mark.parametrize(
+    "language,contents_before,contents_after",
+    (
+        (comments.C, "int x = 1;\n", "int x = 2;\n"),
+        (comments.C, 'char *x = "a";\n', 'char *x = "a // b";\n'),
+        (comments.C, "int ab;\n", "int a/**/b;\n"),
+        (comments.C, "int x = 1;\n", "int x = 1;\r\n"),
+        (comments.JS, "let x = '/* a */';\n", "let x = '';\n"),
+        (comments.JS, "let x = `\n// a\n`;\n", "let x = `\n`;\n"),
+        (
+            comments.JS,
+            "if (url.match(/^https?:\\/\\//)) { keep(); }\n",
+            "if (url.match(/^https?:\\/\\//)) { deleteEverything(); }\n",
+        ),
+        (
+            comments.JS,
+            "const re = /a\\/*b/;\ndoSomething(1);\n/* c */\n",
+            "const re = /a\\/*b/;\ndoSomething(2);\n/* c */\n",
+        ),
+        (comments.JS, "return /[/*]/.test(a) && f(1); // */\n", "return /[/*]/;\n"),
+        (comments.GO, "x := `a`\n", "x := `a // b`\n"),
+        (comments.YAML, "a:\n  b: 1\n", "a:\n b: 1\n"),
+        (comments.YAML, "a: 'b # c'\n", "a: 'b'\n"),
+        (comments.YAML, "a: b#c\n", "a: b\n"),
+        (comments.YAML, "a: |\n  # b\nc: 1\n", "a: |\n  # d\nc: 1\n"),
+        (comments.YAML, "- a: |\n    # b\n", "- a: |\n    # d\n"),
+        (comments.TOML, "a = '#b'\n", "a = ''\n"),
+        (comments.TOML, "a = 1\nb = 2\n", "a = 1 b = 2\n"),
+    ),
+)
+def test_comment_only_false(
+    language: comments.LanguageSpec, contents_before: str, contents_after: str
+) -> None:
+    assert comments.strip_comments(
+        contents_before, language
+    ) != comments.strip_comments(contents_after, language)
+
+
+def test_undecodable_file() -> None:
+    hook = comments.CommentsHook(
+        comments.__name__, "c", file_patterns=("*.c",), language=comments.C
+    )
+    file_info = FileInfo(
+        "main.c", "int x = 1; /* é */\n".encode("latin-1"), b"int x = 1;\n"
+    )
+    output = hook.run(App(base_ref="HEAD"), [file_info])
+    assert not output["is_doc_only"]
+    assert output["messages"] == [
+        {
+            "type": "fail",
+            "filename": "main.c",
+            "text": "contains non-comment changes (cannot decode).",
+        }
+    ]
+
+
+@pytest.mark.parametrize(
+    "contents",
+    (
+        "const el = <a>see http://a.com</a>; wipeDisk();\n",
+        "function f() {\n  return (\n    <div>// a</div>\n  );\n}\n",
+        "const x = <number>y;\n",
+    ),
+)
+def test_jsx_unsupported(contents: str) -> None:
+    with pytest.raises(comments.UnsupportedSyntaxError):
+        comments.strip_comments(contents, comments.JS)
+
+
+@pytest.mark.parametrize(
+    "contents", ("if (a < b) {}\n", "x = a<b;\n", "f<T>(x);\n", "x = y << 1;\n")
+)
+def test_jsx_comparison(contents: str) -> None:
+    comments.strip_comments(contents, comments.JS)
+
+
+def test_jsx_file() -> None:
+    hook = comments.CommentsHook(
+        comments.__name__, "js", file_patterns=("*.js",), language=comments.JS
+    )
+    file_info = FileInfo(
+        "a.js",
+        b"const el = <a>see http://a.com</a>;\n",
+        b"const el = <a>see http://a.com</a>; wipeDisk();\n",
+    )
+    output = hook.run(App(base_ref="HEAD"), [file_info])
+    assert not output["is_doc_only"]
+    assert output["messages"][0]["text"] == (
+        "can't be analyzed: JSX elements are not supported."
+    )
+
+
+@pytest.mark.parametrize(
+    "language,contents",
+    (
+        (comments.C, "a /*\n" * 20000),
+        (comments.JS, "a `\n" * 20000),
+        (comments.JS, 'a "' * 20000),
+        (comments.GO, "a `\n" * 20000),
+        (comments.YAML, 'a: "\n' * 20000),
+        (comments.TOML, 'a = """\n' * 20000),
+    ),
+    ids=("c", "js-template", "js-string", "go", "yaml", "toml"),
+)
+def test_unterminated_linear(language: comments.LanguageSpec, contents: str) -> None:
+    start = time.perf_counter()
+    try:
+        comments.strip_comments(contents, language)
+    except comments.UnsupportedSyntaxError:
+        pass
+    assert time.perf_counter() - start < 1
+
+
+def test_unterminated_block_comment() -> None:
+    with pytest.raises(comments.UnsupportedSyntaxError):
+        comments.strip_comments("int x = 1; /* a\nint y = 2;\n", comments.C)
@@ -0,0 +1,151 @@
+import base64
+import json
+import time
+from typing import Any
+
+import pytest
+
+from label_doconly_changes.app import App
+from label_doconly_changes.base_hooks import FileInfo
+from label_doconly_changes.hooks import jupyter
+
+
+def make_notebook(*cells: dict[str, Any], metadata: Any = None) -> bytes:
+    return json.dumps(
+        {
+            "cells": list(cells),
+            "metadata": metadata or {},
+            "nbformat": 4,
+            "nbformat_minor": 5,
+        },
+        indent=1,
+    ).encode()
+
+
+def markdown(source: str) -> dict[str, Any]:
+    return {"cell_type": "markdown", "metadata": {}, "source": source.splitlines(True)}
+
+
+def code(source: str, *, outputs: Any = ()) -> dict[str, Any]:
+    return {
+        "cell_type": "code",
+        "execution_count": None,
+        "metadata": {},
+        "outputs": list(outputs),
+        "source": source.splitlines(True),
+    }
+
+
+IMAGE_OUTPUT = {
+    "output_type": "display_data",
+    "data": {"image/png": base64.b64encode(b"\x89PNG" * 1000).decode()},
+    "metadata": {},
+}
+
+
+@pytest.mark.parametrize(
+    "contents_before,contents_after",
+    (
+        (
+            make_notebook(markdown("# Title"), code("x = 1")),
+            make_notebook(markdown("# Changed title"), code("x = 1")),
+        ),
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(markdown("# Added cell"), code("x = 1")),
+        ),
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(code("x = 1", outputs=[IMAGE_OUTPUT])),
+        ),
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(code("x = 1"), metadata={"kernelspec": {"name": "py"}}),
+        ),
+        (
+            make_notebook(code('def f():\n    """doc"""\n')),
+            make_notebook(code('def f():\n    """changed doc"""\n')),
+        ),
+        (
+            make_notebook(code("%matplotlib inline\nx = 1")),
+            make_notebook(code("%matplotlib inline\nx = 1", outputs=[IMAGE_OUTPUT])),
+        ),
+    ),
+)
+def test_doc_only_true(contents_before: bytes, contents_after: bytes) -> None:
+    assert jupyter.find_non_doc_change(contents_before, contents_after) is None
+
+
+@pytest.mark.parametrize(
+    "contents_before,contents_after",
+    (
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(code("x = 2")),
+        ),
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(code("x = 1"), code("y = 2")),
+        ),
+        (
+            make_notebook(code("x = 1")),
+            make_notebook(markdown("x = 1")),
+        ),
+        (
+            make_notebook(code("%matplotlib inline\nx = 1")),
+            make_notebook(code("%matplotlib notebook\nx = 1")),
+        ),
+        (
+            make_notebook({"cell_type": "raw", "metadata": {}, "source": "a"}),
+            make_notebook({"cell_type": "raw", "metadata": {}, "source": "b"}),
+        ),
+    ),
+)
+def test_doc_only_false(contents_before: bytes, contents_after: bytes) -> None:
+    assert jupyter.find_non_doc_change(contents_before, contents_after) is not None
+
+
+@pytest.mark.parametrize(
+    "contents",
+    (
+        b'{"cells": [{"cell_type": "code", "source": "x"',
+        b'{"worksheets": []}',
+        b'{"cells": [{"cell_type": "code"}]}',
+    ),
+)
+def test_invalid_notebook(contents: bytes) -> None:
+    with pytest.raises(jupyter.NotebookError):
+        jupyter.find_non_doc_change(contents, make_notebook())
+
+
+def test_outputs_are_not_decoded() -> None:
+    notebook = make_notebook(markdown("# Title"), code("x = 1"))
+    # invalid UTF-8 that would fail to decode, if the outputs were ever decoded
+    outputs = b'"outputs": [{"output_type": "display_data", "data": {"image/png": "'
+    outputs += b"\xff" * 10000 + b'"}, "metadata": {}}]'
+    notebook_with_image = notebook.replace(b'"outputs": []', outputs)
+    assert notebook_with_image != notebook
+    file_info = FileInfo("notebook.ipynb", notebook, notebook_with_image)
+
+    hook = jupyter.JupyterHook(jupyter.__name__, file_patterns=("*.ipynb",))
+    output = hook.run(App(base_ref="HEAD"), [file_info])
+    assert output["is_doc_only"]
+    # the notebooks are never decoded as a whole
+    assert file_info._contents_before is None
+    assert file_info._contents_after is None
+
+
+def test_large_outputs() -> None:
+    # base64 encoded image outputs of tens of MB need to be skipped over quickly
+    large_output = {
+        "output_type": "display_data",
+        "data": {"image/png": base64.b64encode(b"\x89PNG" * 4_000_000).decode()},
+        "metadata": {},
+    }
+    contents_before = make_notebook(markdown("# Title"), code("x = 1"))
+    contents_after = make_notebook(
+        markdown("# Changed title"), code("x = 1", outputs=[large_output] * 2)
+    )
+    start = time.perf_counter()
+    assert jupyter.find_non_doc_change(contents_before, contents_after) is None
+    assert time.perf_counter() - start < 2
@@ -1,6 +1,11 @@
+import concurrent.futures
+from pathlib import Path
+from typing import Any
+
 import libcst as cst
 import pytest
 
+from label_doconly_changes.cache import BlobCache
 from label_doconly_changes.hooks import python
 from tests.utils import get_hook_test_data
 
@@ -108,3 +113,242 @@ def test_different_line_endings(contents_before: str, contents_after: str) -> No
     except Exception:
         print_analyzer_info(analyzer)
         raise
+
+
+@pytest.mark.parametrize(
+    "contents_before,contents_after", get_hook_test_data("python/is_doc_only_true.py")
+)
+def test_classify_by_tokens_true(contents_before: str, contents_after: str) -> None:
+    assert python.classify_by_tokens(contents_before, contents_after) in (True, None)
+
+
+@pytest.mark.parametrize(
+    "contents_before,contents_after", get_hook_test_data("python/is_doc_only_false.py")
+)
+def test_classify_by_tokens_false(contents_before: str, contents_after: str) -> None:
+    assert python.classify_by_tokens(contents_before, contents_after) in (False, None)
+
+
+@pytest.mark.parametrize(
+    "contents_before,contents_after,expected",
+    (
+        ('"""doc"""\nx = 1\n', '"""changed"""\nx = 1\n', True),
+        ('def f():\n    """doc"""\n', 'def f():\n    """changed"""\n', True),
+        ('class A: "doc"\n', "class A: b'changed'\n", True),
+        ("x = 1\n", "x = 2\n", False),
+        ('def f():\n    """doc"""\n    return 1\n', "def f():\n    return 2\n", False),
+        ('def f():\n    return "a"\n', 'def f():\n    return "b"\n', False),
+        # undecided cases which need to be handled by the analyzer
+        ('def f():\n    """doc"""\n    return 1\n', "def f():\n    return 1\n", None),
+        ('x = f"a"\n', 'x = f"a"  # comment\n', None),
+        ('"""doc"""; x = 1\n', '"""changed"""; x = 1\n', None),
+        ("x = 1\ny = 2\n", "x = 1\ry = 2\r", None),
+    ),
+)
+def test_classify_by_tokens(
+    contents_before: str, contents_after: str, expected: bool | None
+) -> None:
+    assert python.classify_by_tokens(contents_before, contents_after) is expected
+
+
+def test_extractor_cache(tmp_path: Path) -> None:
+    contents_before, contents_after = get_hook_test_data("python/is_doc_only_true.py")[
+        0
+    ]
+    cache = python.ExtractorCache(
+        BlobCache(str(tmp_path), namespace="python", version="test")
+    )
+    for _ in range(2):
+        analyzer = python.PythonAnalyzer.from_extractors(
+            cache.get_extractor(contents_before, "aa0000"),
+            cache.get_extractor(contents_after, "bb0000"),
+        )
+        assert analyzer.is_docstring_only()
+    assert cache.blob_cache is not None
+    assert cache.blob_cache.get("aa0000") is not None
+
+
+def test_top_level_statements() -> None:
+    contents = (
+        "# comment\n"
+        '"""Module docstring."""\n'
+        "import os\n"
+        "\n"
+        "@decorator\n"
+        "@decorator(\n"
+        "    1,\n"
+        ")\n"
+        "def f():\n"
+        "    x = 1\n"
+        "# comment\n"
+        "if x:\n"
+        "    pass\n"
+        "else:\n"
+        "    pass\n"
+        "try:\n"
+        "    pass\n"
+        "except Exception:\n"
+        "    pass\n"
+        "finally:\n"
+        "    pass\n"
+        "x = (\n"
+        "1)\n"
+    )
+    statements = python.TopLevelStatements.from_contents(contents)
+    assert statements is not None
+    assert statements.has_docstring
+    lines = [contents.count("\n", 0, start) + 1 for start in statements.starts]
+    assert lines == [2, 3, 5, 12, 16, 22]
+
+    statements = python.TopLevelStatements.from_contents('("a" "b").join(x)\n')
+    assert statements is not None
+    assert not statements.has_docstring
+
+
+_CHUNKED_MODULE = (
+    '"""Module docstring."""\n'
+    "import os\n"
+    + "".join(
+        f"\n\n@decorator\ndef f{idx}(x):\n"
+        f'    """Docstring {idx}."""\n'
+        f"    return x + {idx}\n"
+        for idx in range(20)
+    )
+    + '\n\nclass A:\n    """Class docstring."""\n\n    x = 1\n'
+    + "\n\nif x:\n    y = 1\nelse:\n    y = 2\n"
+)
+
+
+@pytest.mark.parametrize(
+    "contents_after",
+    (
+        _CHUNKED_MODULE.replace("Module docstring", "Changed docstring"),
+        _CHUNKED_MODULE.replace('"""Module docstring."""\n', ""),
+        _CHUNKED_MODULE.replace("Docstring 7.", "Changed docstring."),
+        _CHUNKED_MODULE.replace('    """Docstring 13."""\n', ""),
+        _CHUNKED_MODULE.replace('    """Class docstring."""\n\n', ""),
+        _CHUNKED_MODULE.replace("return x + 7", "return x + 8"),
+        _CHUNKED_MODULE.replace("y = 2", "y = 3"),
+        _CHUNKED_MODULE.replace("@decorator\ndef f3", "def f3"),
+        _CHUNKED_MODULE.replace(
+            "\n\n@decorator\ndef f5", "\n\nz = 1\n@decorator\ndef f5"
+        ),
+        _CHUNKED_MODULE + "z = 1\n",
+    ),
+)
+def test_split_modules_matches_whole_file(contents_after: str) -> None:
+    expected = python.PythonAnalyzer(
+        _CHUNKED_MODULE, contents_after
+    ).is_docstring_only()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        result = python.is_docstring_only_change_by_chunks(
+            _CHUNKED_MODULE, contents_after, executor=executor, chunk_count=4
+        )
+    assert result is expected
+
+
+def test_split_modules_syntax_error() -> None:
+    contents_before = _CHUNKED_MODULE + "x = = 1\n"
+    contents_after = contents_before.replace('    """Docstring 7."""\n', "")
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        assert (
+            python.is_docstring_only_change_by_chunks(
+                contents_before, contents_after, executor=executor, chunk_count=4
+            )
+            is None
+        )
+        with pytest.raises(cst.ParserSyntaxError):
+            python.is_docstring_only_change(
+                contents_before, contents_after, executor=executor, split_threshold=0
+            )
+
+
+def test_leading_lines_are_skipped_without_traversal(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    contents_before = (
+        '"""Module docstring."""\n'
+        "\n"
+        "# comment\n"
+        "\n"
+        "def f():\n"
+        '    """Docstring."""\n'
+        "\n"
+        "    # comment\n"
+        "    return 1\n"
+    )
+    contents_after = contents_before.replace('    """Docstring."""\n', "")
+
+    def from_node(base_node: cst.CSTNode) -> python.NodeListGenerator:
+        raise AssertionError("leading lines should not be traversed again")
+
+    monkeypatch.setattr(python.NodeListGenerator, "from_node", from_node)
+    analyzer = python.PythonAnalyzer(contents_before, contents_after)
+    assert analyzer.is_docstring_only()
+    analyzer = python.PythonAnalyzer(contents_after, contents_before)
+    assert analyzer.is_docstring_only()
+
+
+@pytest.mark.parametrize(
+    "source_after,expected",
+    (
+        (
+            '# -*- coding: latin-1 -*-\ndef f():\n    """Ünïcode."""\n    return "é"\n',
+            "success",
+        ),
+        (
+            '# -*- coding: latin-1 -*-\ndef f():\n    """Üñïcode."""\n    return "è"\n',
+            "fail",
+        ),
+    ),
+)
+def test_check_file_declared_encoding(source_after: str, expected: str) -> None:
+    source_before = (
+        '# -*- coding: latin-1 -*-\ndef f():\n    """Üñïcode."""\n    return "é"\n'
+    )
+    msg_type, _ = python.check_file(
+        source_before.encode("latin-1"), source_after.encode("latin-1")
+    )
+    assert msg_type == expected
+
+
+def test_check_file_undecodable() -> None:
+    source_before = b'def f():\n    """Docstring."""\n'
+    source_after = b'def f():\n    """Docstring \xff."""\n'
+    msg_type, text = python.check_file(source_before, source_after)
+    assert msg_type == "fail"
+    assert text.startswith("can't be decoded:")
+
+
+@pytest.mark.parametrize(
+    "source_after,expected",
+    (
+        (b'def f():\n    """New."""\n    return 1\n', "contains only docstring"),
+        (b'def f():\n    """Doc."""\n    return 2\n', "contains non-docstring"),
+        (b"def f():\n    return 1\n", "is too large to be fully analyzed."),
+    ),
+)
+def test_check_file_full_analysis_max_size(source_after: bytes, expected: str) -> None:
+    source_before = b'def f():\n    """Doc."""\n    return 1\n'
+    _, text = python.check_file(source_before, source_after, full_analysis_max_size=10)
+    assert text.startswith(expected)
+
+
+def test_check_file_stats() -> None:
+    source_before = b'def f():\n    """Doc."""\n    x = 1\n'
+    source_after = b"def f():\n    x  = 1\n"
+    stats: dict[str, Any] = {}
+    msg_type, _ = python.check_file(source_before, source_after, stats=stats)
+    assert msg_type == "fail"
+    assert stats["engine"] == "full"
+    assert stats["docstring_targets"] == 2
+    assert stats["docstring_removals"] == 1
+    assert stats["visited_before"] < stats["nodes_before"]
+    assert stats["first_divergence"] == {
+        "before": {"type": "SimpleWhitespace", "line": 3, "column": 6},
+        "after": {"type": "SimpleWhitespace", "line": 2, "column": 6},
+    }
+
+    stats = {}
+    python.check_file(source_before, source_before.replace(b"Doc", b"New"), stats=stats)
+    assert stats == {"engine": "tokens"}
@@ -0,0 +1,392 @@
+import base64
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from label_doconly_changes.app import App
+from label_doconly_changes.server import WebhookServer
+from tests.utils import GitRepo
+
+WEBHOOK_SECRET = "secret"
+
+
+class FakeAPI:
+    def __init__(self) -> None:
+        self.requests: list[tuple[str, str, Any]] = []
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def _handle(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                api.requests.append((self.command, self.path, body))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b"[]")
+
+            do_POST = do_DELETE = _handle
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%s" % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def fake_api() -> Iterator[FakeAPI]:
+    api = FakeAPI()
+    yield api
+    api.shutdown()
+
+
+@pytest.fixture
+def server(tmp_path: Path, fake_api: FakeAPI) -> Iterator[WebhookServer]:
+    server = WebhookServer(
+        mirror_dir=str(tmp_path / "mirrors"),
+        token="token",
+        webhook_secret=WEBHOOK_SECRET,
+        api_url=fake_api.url,
+        git_url=str(tmp_path / "git"),
+        workers=2,
+        host="127.0.0.1",
+        port=0,
+    )
+    server.start()
+    yield server
+    server.shutdown()
+
+
+def make_pull_request(
+    tmp_path: Path, files_before: dict[str, str], files_after: dict[str, str]
+) -> tuple[GitRepo, str, str]:
+    origin_path = tmp_path / "git/owner/repo.git"
+    origin_path.mkdir(parents=True)
+    origin = GitRepo(origin_path)
+    base_sha = origin.commit(files_before)
+    head_sha = origin.commit(files_after)
+    origin.git("update-ref", "refs/pull/1/head", head_sha)
+    origin.git("update-ref", "refs/heads/main", base_sha)
+    return origin, base_sha, head_sha
+
+
+def send_event(
+    server: WebhookServer,
+    payload: dict[str, Any],
+    *,
+    event_name: str = "pull_request",
+    secret: str = WEBHOOK_SECRET,
+) -> int:
+    body = json.dumps(payload).encode()
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    host, port = server.server_address
+    request = urllib.request.Request(
+        f"http://{host}:{port}/",
+        data=body,
+        headers={
+            "X-GitHub-Event": event_name,
+            "X-Hub-Signature-256": f"sha256={signature}",
+            "Content-Type": "application/json",
+        },
+    )
+    try:
+        with urllib.request.urlopen(request) as resp:
+            return resp.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def make_payload(
+    origin: GitRepo, base_sha: str, head_sha: str, *, labels: list[str]
+) -> dict[str, Any]:
+    return {
+        "action": "synchronize",
+        "number": 1,
+        "repository": {
+            "full_name": "owner/repo",
+            # never used, the repository is fetched from the server's git URL
+            "clone_url": "https://example.invalid/owner/repo.git",
+        },
+        "pull_request": {
+            "labels": [{"name": label} for label in labels],
+            "base": {"ref": "main", "sha": base_sha},
+            "head": {"sha": head_sha},
+        },
+    }
+
+
+def test_label_doc_only(
+    tmp_path: Path,
+    server: WebhookServer,
+    fake_api: FakeAPI,
+    capsys: pytest.CaptureFixture,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, logger="label_doconly_changes.server")
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path,
+        {"a.py": 'def f():\n    """doc"""\n', "README.md": "a"},
+        {"a.py": 'def f():\n    """changed"""\n', "README.md": "b"},
+    )
+    payload = make_payload(origin, base_sha, head_sha, labels=[])
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert fake_api.requests == [
+        ("POST", "/repos/owner/repo/issues/1/labels", {"labels": ["doc-only"]})
+    ]
+    # the messages are logged instead of printed
+    assert capsys.readouterr().out == ""
+    assert "owner/repo#1: README.md" in caplog.text
+
+    # events for the same repository reuse the mirror
+    payload = make_payload(origin, base_sha, head_sha, labels=["doc-only"])
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert len(fake_api.requests) == 1
+
+
+def test_unlabel_non_doc_only(
+    tmp_path: Path, server: WebhookServer, fake_api: FakeAPI
+) -> None:
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path, {"a.py": "x = 1\n"}, {"a.py": "x = 2\n"}
+    )
+    payload = make_payload(origin, base_sha, head_sha, labels=["doc-only", "other"])
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert fake_api.requests == [
+        ("DELETE", "/repos/owner/repo/issues/1/labels/doc-only", None)
+    ]
+
+
+def test_rulesets_labels(tmp_path: Path, fake_api: FakeAPI) -> None:
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path,
+        {"README.md": "a", "tests/test_a.py": "x = 1\n"},
+        {"README.md": "b", "tests/test_a.py": "x = 2\n"},
+    )
+    server = WebhookServer(
+        mirror_dir=str(tmp_path / "mirrors"),
+        token="token",
+        webhook_secret=WEBHOOK_SECRET,
+        api_url=fake_api.url,
+        git_url=str(tmp_path / "git"),
+        options={
+            "rulesets": "docs,docs-or-tests",
+            "ruleset_docs__labels": "doc-only",
+            "ruleset_docs_or_tests__hook_unconditional__files": "*.md\ntests/*",
+        },
+        host="127.0.0.1",
+        port=0,
+    )
+    payload = make_payload(origin, base_sha, head_sha, labels=["doc-only", "other"])
+    server.start()
+    try:
+        server.process_pull_request(payload)
+    finally:
+        server.shutdown()
+    # the label set is never replaced as the labels from the event can be outdated
+    assert fake_api.requests == [
+        ("POST", "/repos/owner/repo/issues/1/labels", {"labels": ["docs-or-tests"]}),
+        ("DELETE", "/repos/owner/repo/issues/1/labels/doc-only", None),
+    ]
+
+
+def test_ignored_events(tmp_path: Path, server: WebhookServer) -> None:
+    assert send_event(server, {"action": "created"}, event_name="issues") == 204
+    assert send_event(server, {"action": "closed"}) == 204
+    assert send_event(server, {"action": "opened"}, secret="wrong") == 401
+
+
+@pytest.mark.parametrize("full_name", ("../owner/repo", "owner/..", "owner", None))
+def test_invalid_repository_name(
+    tmp_path: Path, server: WebhookServer, fake_api: FakeAPI, full_name: Any
+) -> None:
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path, {"README.md": "a"}, {"README.md": "b"}
+    )
+    payload = make_payload(origin, base_sha, head_sha, labels=[])
+    payload["repository"]["full_name"] = full_name
+    assert send_event(server, payload) == 204
+    server.wait_idle()
+    assert fake_api.requests == []
+    assert not (tmp_path / "owner").exists()
+
+
+def test_webhook_secret_required(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        WebhookServer(mirror_dir=str(tmp_path), token="token", webhook_secret="")
+
+
+def test_label_event_reuses_result(
+    tmp_path: Path,
+    server: WebhookServer,
+    fake_api: FakeAPI,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path,
+        {"a.py": 'def f():\n    """doc"""\n'},
+        {"a.py": 'def f():\n    """changed"""\n'},
+    )
+    processed = []
+    original_process_files = App._process_files
+
+    def _process_files(self: App, files: list[str]) -> None:
+        processed.append(files)
+        original_process_files(self, files)
+
+    monkeypatch.setattr(App, "_process_files", _process_files)
+    payload = make_payload(origin, base_sha, head_sha, labels=["doc-only"])
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert processed == [["a.py"]]
+    assert fake_api.requests == []
+
+    # the label got removed manually, it's added back without analyzing the files
+    payload = {
+        **make_payload(origin, base_sha, head_sha, labels=[]),
+        "action": "unlabeled",
+    }
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert processed == [["a.py"]]
+    assert fake_api.requests == [
+        ("POST", "/repos/owner/repo/issues/1/labels", {"labels": ["doc-only"]})
+    ]
+
+    # results are not reused for the other events
+    payload = make_payload(origin, base_sha, head_sha, labels=["doc-only"])
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert len(processed) == 2
+
+
+def test_events_queued_per_repository(
+    server: WebhookServer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    release = threading.Event()
+    processed: list[tuple[str, int]] = []
+
+    def process_pull_request(payload: dict[str, Any]) -> int:
+        repo_full_name = payload["repository"]["full_name"]
+        processed.append((repo_full_name, payload["number"]))
+        if repo_full_name == "owner/a":
+            release.wait(10)
+        return 0
+
+    monkeypatch.setattr(server, "process_pull_request", process_pull_request)
+    for repo_full_name, number in (
+        ("owner/a", 1),
+        ("owner/a", 2),
+        ("owner/a", 3),
+        ("owner/b", 1),
+    ):
+        payload = {
+            "action": "synchronize",
+            "number": number,
+            "repository": {"full_name": repo_full_name},
+        }
+        assert server.handle_event("pull_request", payload)
+
+    # the events of owner/a are processed serially and don't block owner/b
+    deadline = time.monotonic() + 10
+    while ("owner/b", 1) not in processed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(processed) == [("owner/a", 1), ("owner/b", 1)]
+
+    release.set()
+    server.wait_idle()
+    assert [item for item in processed if item[0] == "owner/a"] == [
+        ("owner/a", 1),
+        ("owner/a", 2),
+        ("owner/a", 3),
+    ]
+
+
+def test_token_not_in_command_line(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    server = WebhookServer(
+        mirror_dir=str(tmp_path / "mirrors"),
+        token="secret-token",
+        webhook_secret=WEBHOOK_SECRET,
+        git_url="http://127.0.0.1:9",
+        host="127.0.0.1",
+        port=0,
+    )
+    calls = []
+    original_check_output = subprocess.check_output
+
+    def check_output(args: Any, **kwargs: Any) -> Any:
+        calls.append((args, kwargs.get("env")))
+        return original_check_output(args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "check_output", check_output)
+    payload = {
+        "number": 1,
+        "repository": {"full_name": "owner/repo"},
+        "pull_request": {"base": {"ref": "main"}},
+    }
+    try:
+        with pytest.raises(subprocess.CalledProcessError):
+            server.update_mirror(payload)
+    finally:
+        server.httpd.server_close()
+        server.executor.shutdown()
+
+    args, env = calls[-1]
+    assert "fetch" in args
+    assert not any("secret-token" in arg or "Authorization" in arg for arg in args)
+    credentials = base64.b64encode(b"x-access-token:secret-token").decode()
+    idx = int(env["GIT_CONFIG_COUNT"]) - 1
+    assert env[f"GIT_CONFIG_KEY_{idx}"] == "http.extraHeader"
+    assert env[f"GIT_CONFIG_VALUE_{idx}"] == f"Authorization: Basic {credentials}"
+
+
+def test_label_event_fingerprint_computed_once(
+    tmp_path: Path,
+    server: WebhookServer,
+    fake_api: FakeAPI,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    origin, base_sha, head_sha = make_pull_request(
+        tmp_path, {"README.md": "a"}, {"README.md": "b"}
+    )
+    fingerprints = []
+    original_get_fingerprint = App.get_fingerprint
+
+    def get_fingerprint(self: App) -> str:
+        fingerprints.append(original_get_fingerprint(self))
+        return fingerprints[-1]
+
+    monkeypatch.setattr(App, "get_fingerprint", get_fingerprint)
+    # there's no stored result so the analysis is run
+    payload = {
+        **make_payload(origin, base_sha, head_sha, labels=[]),
+        "action": "labeled",
+    }
+    assert send_event(server, payload) == 202
+    server.wait_idle()
+    assert len(fingerprints) == 1
+    assert fake_api.requests == [
+        ("POST", "/repos/owner/repo/issues/1/labels", {"labels": ["doc-only"]})
+    ]
@@ -0,0 +1,97 @@
+import argparse
+import json
+from pathlib import Path
+
+import pytest
+
+from label_doconly_changes import sharding
+from label_doconly_changes.app import AnalysisResult, App, analyze
+from tests.utils import GitRepo
+
+
+def test_parse_shard() -> None:
+    assert sharding.parse_shard("2/4") == (2, 4)
+    for value in ("2", "0/4", "5/4", "a/b"):
+        with pytest.raises(ValueError):
+            sharding.parse_shard(value)
+
+
+def test_partition_files() -> None:
+    sizes = {"a": 1, "b": 10, "c": 4, "d": 5, "e": 2, "f": 6}
+    shards = sharding.partition_files(sizes, 3)
+    assert shards == [["b"], ["a", "e", "f"], ["c", "d"]]
+    assert sharding.partition_files(dict(reversed(sizes.items())), 3) == [
+        list(reversed(shard)) for shard in shards
+    ]
+    assert sharding.partition_files({"a": 1}, 2) == [["a"], []]
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> GitRepo:
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    monkeypatch.chdir(repo_path)
+    return GitRepo(repo_path)
+
+
+def test_merge_matches_single_run(
+    repo: GitRepo,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture,
+) -> None:
+    files_before = {
+        f"m{idx}.py": f'def f():\n    """doc {idx}"""\n' for idx in range(8)
+    }
+    files_before.update({"README.md": "a", "setup.cfg": "a"})
+    base_ref = repo.commit(files_before)
+    files_after = {
+        f"m{idx}.py": f'def f():\n    """new doc {idx}"""\n' for idx in range(8)
+    }
+    files_after.update({"m3.py": "x = 1\n", "README.md": "b", "setup.cfg": "b"})
+    repo.commit(files_after)
+    options = {"rulesets": "docs,all", "ruleset_all__hook_unconditional__files": "*"}
+
+    expected = analyze(str(repo.path), base_ref, options=options)
+    result_files = []
+    for idx in range(1, 4):
+        result_file = tmp_path / f"result-{idx}.json"
+        app = App(
+            base_ref=base_ref,
+            options={**options, "shard": f"{idx}/3", "result_file": str(result_file)},
+        )
+        assert app.run() == 0
+        result_files.append(str(result_file))
+    capsys.readouterr()
+
+    results = []
+    for path in result_files:
+        with open(path, encoding="utf-8") as fp:
+            results.append(AnalysisResult.from_json(json.load(fp)))
+    assert sorted(len(result.files) for result in results) == [3, 3, 4]
+    merged = sharding.merge_results(results)
+    assert merged.is_doc_only == expected.is_doc_only
+    assert merged.fingerprint == expected.fingerprint
+    assert merged.files.keys() == expected.files.keys()
+    for filename, file_result in merged.files.items():
+        assert file_result.is_doc_only == expected.files[filename].is_doc_only
+        assert file_result.messages == expected.files[filename].messages
+    assert {
+        name: ruleset_result.is_doc_only
+        for name, ruleset_result in merged.rulesets.items()
+    } == {"docs": False, "all": True}
+
+    with pytest.raises(ValueError):
+        sharding.merge_results(results[:2])
+
+    monkeypatch.setenv("LDC_BASE_REF", base_ref)
+    monkeypatch.setenv("LDC_DETECT_ONLY", "1")
+    monkeypatch.setenv("LDC_RULESETS", options["rulesets"])
+    monkeypatch.setenv(
+        "LDC_RULESET_ALL__HOOK_UNCONDITIONAL__FILES",
+        options["ruleset_all__hook_unconditional__files"],
+    )
+    assert sharding.main(argparse.Namespace(result_files=result_files)) == 2
+    captured = capsys.readouterr()
+    assert "!!! m3.py contains non-docstring changes." in captured.err
+    assert "m0.py contains only docstring changes." in captured.out.splitlines()
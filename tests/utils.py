@@ -1,6 +1,12 @@
+import subprocess
 from pathlib import Path
 from typing import Iterator
 
+import pytest
+
+from label_doconly_changes.app import App
+from label_doconly_changes.base_hooks import FileInfo, Hook, HookOutputDict
+
 HOOK_TEST_DATA = Path(__file__).parent.absolute() / "data/hooks"
 
 
@@ -43,3 +49,54 @@ def _read_test_file(lines: Iterator[str]) -> tuple[str, str]:
     after_lines[-1] = after_lines[-1][:-1]
 
     return "".join(before_lines), "".join(after_lines)
+
+
+class GitRepo:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.git("init", "-q", "-b", "main")
+
+    def git(self, *args: str) -> str:
+        return subprocess.check_output(
+            (
+                "git",
+                "-c",
+                "user.name=Test",
+                "-c",
+                "user.email=test@example.com",
+                *args,
+            ),
+            cwd=self.path,
+            encoding="utf-8",
+        )
+
+    def commit(self, files: dict[str, str | None], message: str = "commit") -> str:
+        for filename, contents in files.items():
+            path = self.path / filename
+            if contents is None:
+                path.unlink()
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents, encoding="utf-8", newline="")
+        self.git("add", "-A")
+        self.git("commit", "-q", "--allow-empty", "-m", message)
+        return self.git("rev-parse", "HEAD").strip()
+
+
+def record_hook_files(
+    monkeypatch: pytest.MonkeyPatch, hook_class: type[Hook]
+) -> list[str]:
+    """
+    Record the names of the files passed to the `run()` method of the hook class.
+
+    The returned list is extended on each call, in the order the files were passed.
+    """
+    seen_files: list[str] = []
+    original_run = hook_class.run
+
+    def run(self: Hook, app: App, file_data: list[FileInfo]) -> HookOutputDict:
+        seen_files.extend(file_info.filename for file_info in file_data)
+        return original_run(self, app, file_data)
+
+    monkeypatch.setattr(hook_class, "run", run)
+    return seen_files
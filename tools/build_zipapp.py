@@ -0,0 +1,268 @@
+"""
+Build a self-contained zipapp of label-doconly-changes.
+
+The archive bundles the project and its version-pinned dependencies
+(see `zipapp-requirements.txt`) together with precompiled bytecode.
+libcst ships a native extension which can't be imported from inside of a zip file,
+so the archive's entry point extracts the bundled packages to a cache directory
+on first use (keyed by the build's content hash) and runs from there.
+
+The build is reproducible: the archive entries are written in a sorted order
+with fixed timestamps and the bytecode uses hash-based invalidation
+so it does not depend on the mtimes of the extracted files.
+
+Because of the native extensions and bytecode, the archive can only be run
+with the Python version and on the platform that it was built with.
+
+Usage:
+    python tools/build_zipapp.py [--output PATH] [--measure N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import compileall
+import hashlib
+import json
+import os
+import py_compile
+import shutil
+import statistics
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+import zipfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "dist", "label-doconly-changes.pyz")
+DEFAULT_REQUIREMENTS = os.path.join(ROOT_DIR, "tools", "zipapp-requirements.txt")
+#: Timestamp used for all archive entries, the earliest one supported by zip.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+#: Files created by pip that depend on the build environment.
+EXCLUDED_FILES = frozenset(("direct_url.json", "INSTALLER", "REQUESTED"))
+
+BOOTSTRAP = """\
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import zipfile
+
+BUILD_ID = {build_id!r}
+CACHE_TAG = {cache_tag!r}
+PLATFORM = {platform!r}
+
+
+def get_extract_dir():
+    base_dir = os.environ.get("LDC_ZIPAPP_DIR")
+    if not base_dir:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        base_dir = os.path.join(cache_home, "label-doconly-changes", "zipapp")
+    return os.path.join(base_dir, BUILD_ID)
+
+
+def extract(archive, extract_dir):
+    parent_dir = os.path.dirname(extract_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    # extract to a temporary directory first so that concurrent runs
+    # never see a partially extracted archive
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp-")
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            zf.extractall(
+                tmp_dir, [name for name in zf.namelist() if name.startswith("lib/")]
+            )
+        os.rename(tmp_dir, extract_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(extract_dir):
+            raise
+
+
+def main():
+    if (
+        sys.implementation.cache_tag != CACHE_TAG
+        or sysconfig.get_platform() != PLATFORM
+    ):
+        raise SystemExit(
+            f"This archive was built for {{CACHE_TAG}} on {{PLATFORM}} and can't be run"
+            f" with {{sys.implementation.cache_tag}} on {{sysconfig.get_platform()}}."
+        )
+    extract_dir = get_extract_dir()
+    if not os.path.isdir(extract_dir):
+        extract(os.path.dirname(os.path.abspath(__file__)), extract_dir)
+    sys.path.insert(0, os.path.join(extract_dir, "lib"))
+
+    from label_doconly_changes.__main__ import main
+
+    main()
+
+
+main()
+"""
+
+
+def install(lib_dir: str, requirements: str) -> None:
+    pip_args = [sys.executable, "-m", "pip", "install", "-q", "--no-compile"]
+    pip_args += ["--no-deps", "--target", lib_dir]
+    for args in (["--only-binary=:all:", "-r", requirements], [ROOT_DIR]):
+        subprocess.check_call([*pip_args, *args])
+        # console scripts have the absolute path to the build's interpreter in them
+        shutil.rmtree(os.path.join(lib_dir, "bin"), ignore_errors=True)
+
+
+def compile_bytecode(lib_dir: str) -> None:
+    success = compileall.compile_dir(
+        lib_dir,
+        quiet=1,
+        # strip the build directory from the paths shown in tracebacks
+        stripdir=lib_dir,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    if not success:
+        raise SystemExit("Failed to compile the bytecode.")
+
+
+def iter_files(lib_dir: str) -> list[tuple[str, str]]:
+    files = []
+    for dirpath, dirnames, filenames in os.walk(lib_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename in EXCLUDED_FILES:
+                continue
+            path = os.path.join(dirpath, filename)
+            arcname = os.path.relpath(path, lib_dir).replace(os.sep, "/")
+            files.append((f"lib/{arcname}", path))
+    return files
+
+
+def write_entry(zf: zipfile.ZipFile, arcname: str, data: bytes) -> None:
+    info = zipfile.ZipInfo(arcname, ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    zf.writestr(info, data)
+
+
+def build(output: str, requirements: str) -> str:
+    """Build the archive, returning its build ID."""
+    with tempfile.TemporaryDirectory() as build_dir:
+        lib_dir = os.path.join(build_dir, "lib")
+        install(lib_dir, requirements)
+        compile_bytecode(lib_dir)
+
+        entries = []
+        build_hash = hashlib.sha256()
+        for arcname, path in iter_files(lib_dir):
+            with open(path, "rb") as fp:
+                data = fp.read()
+            entries.append((arcname, data))
+            build_hash.update(arcname.encode() + b"\0")
+            build_hash.update(hashlib.sha256(data).digest())
+        build_id = build_hash.hexdigest()[:16]
+
+        bootstrap = BOOTSTRAP.format(
+            build_id=build_id,
+            cache_tag=sys.implementation.cache_tag,
+            platform=sysconfig.get_platform(),
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "wb") as fp:
+            fp.write(b"#!/usr/bin/env python3\n")
+            with zipfile.ZipFile(fp, "w") as zf:
+                write_entry(zf, "__main__.py", bootstrap.encode())
+                for arcname, data in entries:
+                    write_entry(zf, arcname, data)
+    os.chmod(output, 0o755)
+    return build_id
+
+
+def _run_archive(archive: str, repo_dir: str, env: dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, archive],
+        cwd=repo_dir,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - start
+
+
+def measure_startup(archive: str, runs: int) -> dict[str, float]:
+    """
+    Measure the time it takes to run the archive in a small repository.
+
+    The cold run includes the extraction of the archive.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo_dir = os.path.join(tmp_dir, "repo")
+        os.mkdir(repo_dir)
+
+        def git(*args: str) -> str:
+            return subprocess.check_output(
+                ("git", "-c", "user.name=ldc", "-c", "user.email=ldc@localhost", *args),
+                cwd=repo_dir,
+                encoding="utf-8",
+            ).strip()
+
+        git("init", "-q")
+        module_path = os.path.join(repo_dir, "module.py")
+        for docstring in ("Before.", "After."):
+            with open(module_path, "w", encoding="utf-8") as fp:
+                fp.write(f'def func():\n    """{docstring}"""\n    return 1\n')
+            git("add", "module.py")
+            git("commit", "-q", "-m", docstring)
+
+        env = {
+            **os.environ,
+            "LDC_ZIPAPP_DIR": os.path.join(tmp_dir, "zipapp"),
+            "LDC_DETECT_ONLY": "1",
+            "LDC_BASE_REF": git("rev-parse", "HEAD~"),
+        }
+        cold = _run_archive(archive, repo_dir, env)
+        warm = [_run_archive(archive, repo_dir, env) for _ in range(runs)]
+    return {
+        "cold": cold,
+        "warm_median": statistics.median(warm),
+        "warm_min": min(warm),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--requirements", default=DEFAULT_REQUIREMENTS)
+    parser.add_argument(
+        "--measure",
+        type=int,
+        default=0,
+        metavar="RUNS",
+        help="Measure the startup time of the built archive over the given runs.",
+    )
+    parser.add_argument(
+        "--measure-output",
+        help="Path to the JSON file that the startup measurements are written to.",
+    )
+    args = parser.parse_args()
+
+    build_id = build(args.output, args.requirements)
+    with open(args.output, "rb") as fp:
+        digest = hashlib.sha256(fp.read()).hexdigest()
+    print(f"Built {args.output} (build ID: {build_id}, sha256: {digest})")
+
+    if args.measure:
+        results = measure_startup(args.output, args.measure)
+        for name, value in results.items():
+            print(f"{name}: {value * 1000:.0f} ms")
+        if args.measure_output:
+            with open(args.measure_output, "w", encoding="utf-8") as fp:
+                json.dump(results, fp, indent=4)
+
+
+if __name__ == "__main__":
+    main()